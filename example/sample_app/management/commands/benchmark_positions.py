@@ -0,0 +1,271 @@
+"""
+Benchmarks the positions managers, template tags and views against a
+synthetic dataset of sample_app content in a throwaway test database.
+
+    ./manage.py benchmark_positions --positions=20 --items=10 --output=new.json
+    ./manage.py benchmark_positions --compare=old.json new.json
+"""
+import os
+import time
+from optparse import make_option
+
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template import Template, Context
+from django.test.client import RequestFactory
+from django.contrib.contenttypes.models import ContentType
+try:
+    from django.utils import simplejson
+except ImportError:
+    import json as simplejson
+
+import django
+from positions import caching, settings as position_settings
+from positions.models import Position, PositionContent, clear_template_cache
+from positions.views import json_data
+from sample_app.models import DummyEntry, DummyBookmark, DummyVideo, DummyImage
+
+CONTENT_MODELS = (DummyEntry, DummyBookmark, DummyVideo, DummyImage)
+
+
+class Command(BaseCommand):
+    args = '[results.json]'
+    help = ('Benchmarks the positions API on a synthetic dataset, or '
+        'compares the results of two runs.')
+    option_list = BaseCommand.option_list + (
+        make_option('--positions', type='int', default=20,
+            help='The number of positions.'),
+        make_option('--items', type='int', default=10,
+            help='The count of every position.'),
+        make_option('--types', type='int', default=4,
+            help='The number of content types, at most 4.'),
+        make_option('--overlap', type='int',
+            default=position_settings.CONTENT_OVERLAP_COUNT,
+            help='The POSITION_CONTENT_OVERLAP_COUNT to use.'),
+        make_option('--padding', type='int', default=0,
+            help='The number of unrelated position content rows to add, to '
+                'measure the queries against a large table.'),
+        make_option('--cache-timeout', type='int', default=60 * 60,
+            help='The POSITION_CACHE_TIMEOUT to use, 0 disables the cache.'),
+        make_option('--repeat', type='int', default=5,
+            help='The number of times each benchmark is run.'),
+        make_option('--output', default=None,
+            help='Write the results as JSON to this file.'),
+        make_option('--compare', default=None,
+            help='Compare the results in this file with the results in '
+                'the file given as argument.'),
+        make_option('--threshold', type='float', default=10.0,
+            help='The percentage a benchmark may slow down before it is '
+                'reported as a regression.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            if len(args) != 1:
+                raise CommandError('Supply the results file to compare with.')
+            return self.compare(options['compare'], args[0],
+                options['threshold'])
+
+        if not 1 <= options['types'] <= len(CONTENT_MODELS):
+            raise CommandError('--types must be between 1 and %s.' %
+                len(CONTENT_MODELS))
+
+        old_overlap = position_settings.CONTENT_OVERLAP_COUNT
+        old_name = connection.settings_dict['NAME']
+        old_cache = caching.cache
+        old_prefix = position_settings.CACHE_PREFIX
+        old_timeout = position_settings.CACHE_TIMEOUT
+        position_settings.CONTENT_OVERLAP_COUNT = options['overlap']
+        # Keep the positions of the test database out of the project's
+        # cache, which may be shared with the site.
+        caching.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache',
+            LOCATION='positions-benchmark-%s' % os.getpid())
+        position_settings.CACHE_PREFIX = 'positions-benchmark'
+        position_settings.CACHE_TIMEOUT = options['cache_timeout']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            caching.cache.clear()
+            caching.cache = old_cache
+            position_settings.CACHE_PREFIX = old_prefix
+            position_settings.CACHE_TIMEOUT = old_timeout
+            position_settings.CONTENT_OVERLAP_COUNT = old_overlap
+
+        data = {
+            'meta': {
+                'django': django.get_version(),
+                'positions': options['positions'],
+                'items': options['items'],
+                'types': options['types'],
+                'overlap': options['overlap'],
+                'padding': options['padding'],
+                'cache_timeout': options['cache_timeout'],
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            f = open(options['output'], 'w')
+            try:
+                simplejson.dump(data, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+
+        for name in sorted(results):
+            self.stdout.write('%-40s %10.3fms %6s queries\n' % (name,
+                results[name]['time'] * 1000, results[name]['queries']))
+
+    def build_dataset(self, options):
+        """
+        Create the positions, each filled with its count plus the overlap of
+        content spread over the content types.
+        """
+        models = CONTENT_MODELS[:options['types']]
+        per_position = options['items'] + options['overlap']
+        objs = []
+        for i in range(per_position):
+            model = models[i % len(models)]
+            if model is DummyEntry:
+                obj = model(title='Entry %s' % i, body='Body', author='Author')
+            else:
+                obj = model(url='http://example.com/%s/' % i, name='Item %s' % i)
+            objs.append(obj)
+        for model in models:
+            model.objects.bulk_create([o for o in objs if isinstance(o, model)])
+        objs = []
+        for model in models:
+            objs.extend(model.objects.all())
+
+        ctypes = [ContentType.objects.get_for_model(m) for m in models]
+        positions = []
+        for i in range(options['positions']):
+            position = Position.objects.create(name='position_%s' % i,
+                count=options['items'])
+            position.eligible_types.add(*ctypes)
+            Position.objects.add_objects(position, objs)
+            positions.append(position)
+
+        if options['padding']:
+            filler = Position.objects.create(name='padding',
+                count=options['padding'], allow_all_types=True)
+            for start in range(0, options['padding'], 10000):
+                PositionContent.objects.bulk_create([PositionContent(
+                    position=filler, content_type=ctypes[i % len(ctypes)],
+                    object_id=str(i), order=i) for i in range(start,
+                        min(start + 10000, options['padding']))])
+        return positions, objs, ctypes
+
+    def measure(self, func, repeat, setup=None):
+        """
+        Returns the mean wall time and the number of queries of [func].
+        """
+        total, queries = 0.0, 0
+        for i in range(repeat):
+            if setup:
+                setup()
+            connection.queries = []
+            start = time.time()
+            func()
+            total += time.time() - start
+            queries = len(connection.queries)
+        return {'time': total / repeat, 'queries': queries}
+
+    def run_benchmarks(self, options):
+        positions, objs, ctypes = self.build_dataset(options)
+        position, obj = positions[0], objs[0]
+        names = [p.name for p in positions]
+        extra = DummyEntry.objects.create(title='Extra', body='Body',
+            author='Author')
+        repeat = options['repeat']
+        request = RequestFactory().get('/', {'term': 'position'})
+
+        def cold():
+            caching.cache.clear()
+            clear_template_cache()
+
+        def add_extra():
+            Position.objects.add_object(position, extra)
+
+        def remove_extra():
+            Position.objects.remove_object(position, extra)
+
+        def tag(src, **ctx):
+            t = Template('{% load position_tags %}' + src)
+            return lambda: t.render(Context(ctx))
+
+        first_item = PositionContent.objects.filter(position=position)[0]
+        many_tag = ' '.join(['"%s" as p%s' % (n, i) for i, n in enumerate(names)])
+
+        benchmarks = [
+            ('get_content.cold', lambda: Position.objects.get_content(position), cold),
+            ('get_content.warm', lambda: Position.objects.get_content(position), None),
+            ('get_content.by_name', lambda: Position.objects.get_content(position.name), None),
+            ('get_content.positioncontent', lambda: Position.objects.get_content(
+                position, as_contenttype=False), None),
+            ('get_content_many.cold', lambda: Position.objects.get_content_many(names), cold),
+            ('get_content_many.warm', lambda: Position.objects.get_content_many(names), None),
+            ('add_object', add_extra, remove_extra),
+            ('remove_object', remove_extra, add_extra),
+            ('add_objects', lambda: Position.objects.add_objects(position, objs[:3]),
+                lambda: Position.objects.remove_objects(position, objs[:3])),
+            ('reorder', lambda: PositionContent.objects.reorder(position, first_item), None),
+            ('prune', lambda: PositionContent.objects.prune(position), None),
+            ('contains_object', lambda: Position.objects.contains_object(position, obj), None),
+            ('positions_for_object', lambda: list(Position.objects.positions_for_object(obj)), None),
+            ('get_applicable', lambda: list(Position.objects.get_applicable(obj)), None),
+            ('get_applicable.all', lambda: list(Position.objects.get_applicable(obj, True)), None),
+            ('is_applicable', lambda: Position.objects.is_applicable(position, obj), None),
+            ('can_be_positioned', lambda: Position.objects.can_be_positioned(obj), None),
+            ('tag.get_position', tag('{% get_position name as p %}', name=position.name), None),
+            ('tag.get_position_content', tag('{% get_position_content p as c %}{% for i in c %}{{ i }}{% endfor %}', p=position), None),
+            ('tag.get_position_content_many', tag('{% get_position_content_many ' + many_tag + ' %}'), None),
+            ('tag.render_position_content', tag('{% get_position_content p as c as_contenttype=False %}{% for i in c %}{% render_position_content i %}{% endfor %}', p=position), None),
+            ('tag.get_applicable_positions', tag('{% get_applicable_positions o as p %}{% for i in p %}{{ i }}{% endfor %}', o=obj), None),
+            ('tag.get_content_positions', tag('{% get_content_positions o as p %}{% for i in p %}{{ i }}{% endfor %}', o=obj), None),
+            ('tag.can_be_positioned', tag('{% can_be_positioned o as p %}', o=obj), None),
+            ('view.json_data', lambda: json_data(request, ctypes[0].pk, extra.pk), None),
+        ]
+
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            results = {}
+            for name, func, setup in benchmarks:
+                if setup is None:
+                    # Run once so the warm benchmarks measure a warm cache
+                    func()
+                results[name] = self.measure(func, repeat, setup)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        return results
+
+    def compare(self, old_file, new_file, threshold):
+        old = simplejson.load(open(old_file))
+        new = simplejson.load(open(new_file))
+        if old['meta'] != new['meta']:
+            self.stderr.write('Warning: the runs used different parameters.\n')
+
+        regressions = []
+        for name in sorted(set(old['results']) | set(new['results'])):
+            if name not in old['results'] or name not in new['results']:
+                self.stdout.write('%-40s only in one run\n' % name)
+                continue
+            o, n = old['results'][name], new['results'][name]
+            change = 0.0
+            if o['time']:
+                change = (n['time'] - o['time']) / o['time'] * 100
+            flag = ''
+            if change > threshold or n['queries'] > o['queries']:
+                flag = ' REGRESSION'
+                regressions.append(name)
+            self.stdout.write('%-40s %10.3fms %10.3fms %+7.1f%% %4s -> %-4s%s\n' % (
+                name, o['time'] * 1000, n['time'] * 1000, change,
+                o['queries'], n['queries'], flag))
+
+        if regressions:
+            raise CommandError('%s benchmark(s) regressed: %s' % (
+                len(regressions), ', '.join(regressions)))
@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db.models import Count
 
 from positions import settings
-from positions.models import Position, PositionContent
+from positions.models import Position, PositionContent, content_changes
 
 
 class PositionContentInline(admin.TabularInline):
@@ -11,9 +13,24 @@ class PositionContentInline(admin.TabularInline):
     extra = 0
     max_num = 0
     readonly_fields = ('content_object', 'content_type', 'add_date', )
-    fields = ('content_object', 'content_type', 'add_date', 'order', )
+    fields = ('content_object', 'content_type', 'add_date', 'order',
+        'start_date', 'end_date', )
     ordering = ('order', )
 
+    def queryset(self, request):
+        # Load the content objects with one query per content type
+        qs = super(PositionContentInline, self).queryset(request)
+        return qs.select_related('position', 'content_type').prefetch_related(
+            'content_object')
+
+
+class PositionChangeList(ChangeList):
+    """Loads the current items of all the positions on the page at once"""
+
+    def get_results(self, request):
+        super(PositionChangeList, self).get_results(request)
+        self.model_admin.prefetch_current_items(self.result_list)
+
 
 class PositionAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', 'count',  'current_items',
@@ -22,6 +39,48 @@ class PositionAdmin(admin.ModelAdmin):
     filter_horizontal = ('eligible_types',)
     inlines = [PositionContentInline]
 
+    def save_related(self, request, form, formsets, change):
+        # Rewrite the snapshot once for all the content saved by the inline,
+        # and invalidate the position once that content is committed.
+        with content_changes(form.instance):
+            super(PositionAdmin, self).save_related(request, form, formsets,
+                change)
+
+    # The number of items shown by list_eligible_types and current_items
+    list_items = 5
+
+    def queryset(self, request):
+        qs = super(PositionAdmin, self).queryset(request)
+        return qs.annotate(content_count=Count('positioncontent')
+            ).prefetch_related('eligible_types')
+
+    def get_changelist(self, request, **kwargs):
+        return PositionChangeList
+
+    def prefetch_current_items(self, positions):
+        """Load the first items of the supplied positions and their content
+        objects with a fixed number of queries, one per content type for the
+        content objects.
+
+        """
+        positions = dict([(obj.pk, obj) for obj in positions])
+        first = {}
+        for pk, position_id in PositionContent.objects.filter(
+                position__in=positions.keys()).order_by(
+                'position', 'order', '-add_date').values_list('pk', 'position'):
+            first.setdefault(position_id, [])
+            if len(first[position_id]) < self.list_items:
+                first[position_id].append(pk)
+
+        for obj in positions.values():
+            obj._current_items = []
+        pks = [pk for pks in first.values() for pk in pks]
+        if pks:
+            for item in PositionContent.objects.filter(pk__in=pks).select_related(
+                    'content_type').prefetch_related('content_object').order_by(
+                    'order', '-add_date'):
+                positions[item.position_id]._current_items.append(item)
+
     def list_eligible_types(self, obj):
         """Display a list of the eligible types to display on the change list.
 
@@ -30,12 +89,14 @@ class PositionAdmin(admin.ModelAdmin):
 
         """
         items = []
-        eligible_types = obj.eligible_types.all()
-        for content_type in eligible_types[:5]:
+        # Prefetched by queryset
+        eligible_types = list(obj.eligible_types.all())
+        for content_type in eligible_types[:self.list_items]:
             items.append(u'<li>{}.{}</li>'.format(content_type.app_label, content_type.model))
 
-        if eligible_types.count() > 5:
-            items.append(u'<br/>and {} more'.format(eligible_types.count() - 5))
+        if len(eligible_types) > self.list_items:
+            items.append(u'<br/>and {} more'.format(
+                len(eligible_types) - self.list_items))
 
         return u'<ul>{}</ul>'.format(u''.join(items))
     list_eligible_types.allow_tags = True
@@ -53,8 +114,13 @@ class PositionAdmin(admin.ModelAdmin):
 
         """
         items = []
-        position_contents = obj.positioncontent_set.all()
-        for i, pobj in enumerate(position_contents[:5]):
+        position_contents = getattr(obj, '_current_items', None)
+        if position_contents is None:
+            position_contents = obj.positioncontent_set.all()[:self.list_items]
+        count = getattr(obj, 'content_count', None)
+        if count is None:
+            count = obj.positioncontent_set.count()
+        for i, pobj in enumerate(position_contents):
             item = unicode(pobj.content_object)
             try:
                 reverse_name = u'admin:{}_{}_change'.format(
@@ -69,16 +135,23 @@ class PositionAdmin(admin.ModelAdmin):
             if i+1 == obj.count:
                 items.append(u'<hr style="background-color:#a2a2a2;"/>')
 
-        if position_contents.count() > 5:
-            items.append(u'<br/> and {} more'.format(
-                position_contents.count() - 5))
+        if count > self.list_items:
+            items.append(u'<br/> and {} more'.format(count - self.list_items))
 
         return u'<ul>{}</ul>'.format(''.join(items))
     current_items.allow_tags = True
+    current_items.admin_order_field = 'content_count'
 
 
 class PositionContentAdmin(admin.ModelAdmin):
-    list_display = ('position', 'content_object', 'order', 'add_date',)
+    list_display = ('position', 'content_object', 'order', 'add_date',
+        'start_date', 'end_date',)
+
+    def queryset(self, request):
+        # Load the content objects with one query per content type
+        qs = super(PositionContentAdmin, self).queryset(request)
+        return qs.select_related('position', 'content_type').prefetch_related(
+            'content_object')
 
 
 admin.site.register(Position, PositionAdmin)
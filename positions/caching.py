@@ -0,0 +1,208 @@
+"""
+Versioned cache for the contents of positions.
+
+Every position has a version number stored in the cache. The version is part
+of the key the position contents are stored under, so bumping the version
+when a position changes makes the old contents unreachable. Stale entries are
+never deleted, they simply expire.
+"""
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.encoding import smart_str
+from django.utils.http import urlquote
+from django.utils.importlib import import_module
+
+from positions import settings
+
+# Version keys should outlive the content keys they point to.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+# Versioned like a position, the index of the positions eligible for each
+# content type.
+ELIGIBILITY = 'eligibility'
+
+
+def is_enabled():
+    return bool(settings.CACHE_TIMEOUT)
+
+
+def is_shared():
+    """
+    Returns whether the cache backend is shared by the processes of the
+    site, unlike the local memory and dummy caches.
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def _make_key(*bits):
+    return ':'.join([settings.CACHE_PREFIX] + [str(bit) for bit in bits])
+
+
+def _version_key(position_id):
+    return _make_key('version', position_id)
+
+
+def _name_key(name):
+    # Positions are looked up case insensitive, so are their names.
+    return _make_key('name', urlquote(name.lower()))
+
+
+def _new_version():
+    # Use the time so a version key that got evicted does not start over and
+    # point to contents cached under an earlier version.
+    return int(time.time() * 1000)
+
+
+def get_version(position_id):
+    """
+    Returns the current version of the position with the supplied id, or of
+    the ELIGIBILITY index.
+    """
+    key = _version_key(position_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(position_id):
+    """
+    Invalidate everything cached for the position with the supplied id, or
+    the ELIGIBILITY index.
+    """
+    if not is_enabled():
+        return
+    key = _version_key(position_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), VERSION_TIMEOUT)
+
+
+def get_content(position_id, version):
+    """
+    Returns the contents cached for a position version or None.
+    """
+    if not is_enabled():
+        return None
+    return cache.get(_make_key('content', position_id, version))
+
+
+def set_content(position_id, version, data, timeout=None):
+    """
+    Cache the contents of a position version, for [timeout] seconds or
+    POSITION_CACHE_TIMEOUT.
+    """
+    if not is_enabled():
+        return
+    cache.set_many({
+        _make_key('content', position_id, version): data,
+        _make_key('stamp', position_id, version): int(time.time()),
+    }, timeout or settings.CACHE_TIMEOUT)
+
+
+def get_stamp(position_id, version):
+    """
+    Returns the time the contents of a position version were cached, in
+    seconds since the epoch, or None if they are not cached. It changes
+    whenever the contents change, and when scheduled content starts or ends.
+    """
+    if not is_enabled():
+        return None
+    return cache.get(_make_key('stamp', position_id, version))
+
+
+def get_position_id(name):
+    """
+    Returns the id of the position with the supplied name, 0 if there is no
+    such position or None if it is not known.
+    """
+    if not is_enabled():
+        return None
+    return cache.get(_name_key(name))
+
+
+def set_position_id(name, position_id):
+    if not is_enabled():
+        return
+    cache.set(_name_key(name), position_id, settings.CACHE_TIMEOUT)
+
+
+def delete_position_id(name):
+    if not is_enabled():
+        return
+    cache.delete(_name_key(name))
+
+
+def _autocomplete_key(ctype_id, object_id, term):
+    return _make_key('autocomplete', ctype_id, urlquote(object_id),
+        get_version(ELIGIBILITY), md5(smart_str(term)).hexdigest())
+
+
+def get_autocomplete(ctype_id, object_id, term):
+    """
+    Returns the positions cached for the autocomplete of an object and a
+    term or None.
+    """
+    if not is_enabled() or not settings.AUTOCOMPLETE_CACHE_TIMEOUT:
+        return None
+    return cache.get(_autocomplete_key(ctype_id, object_id, term))
+
+
+def set_autocomplete(ctype_id, object_id, term, data):
+    if not is_enabled() or not settings.AUTOCOMPLETE_CACHE_TIMEOUT:
+        return
+    cache.set(_autocomplete_key(ctype_id, object_id, term), data,
+        settings.AUTOCOMPLETE_CACHE_TIMEOUT)
+
+
+def get_content_version(obj):
+    """
+    Returns the token that changes whenever the supplied content object
+    changes, using the POSITION_CONTENT_VERSION setting.
+    """
+    func = settings.CONTENT_VERSION
+    if func is None:
+        return getattr(obj, 'modified', '')
+    if isinstance(func, basestring):
+        module, attr = func.rsplit('.', 1)
+        func = getattr(import_module(module), attr)
+    return func(obj)
+
+
+def get_render_timeout(position_name):
+    """
+    Returns the number of seconds content rendered for a position is cached.
+    Rendered content is cached per position version, so only while the
+    contents of positions are cached and their versions bumped.
+    """
+    if not is_enabled():
+        return 0
+    return settings.RENDER_CACHE_TIMEOUTS.get(position_name,
+        settings.RENDER_CACHE_TIMEOUT)
+
+
+def _fragment_key(item, template_name, suffix):
+    token = md5(smart_str(u'%s|%s|%s' % (template_name, suffix,
+        get_content_version(item.content_object)))).hexdigest()
+    return _make_key('fragment', item.position_id,
+        get_version(item.position_id), item.pk, item.order, token)
+
+
+def get_fragment(item, template_name, suffix):
+    """
+    Returns the content cached for a rendered [PositionContent] or None.
+    """
+    return cache.get(_fragment_key(item, template_name, suffix))
+
+
+def set_fragment(item, template_name, suffix, content, timeout):
+    cache.set(_fragment_key(item, template_name, suffix), content, timeout)
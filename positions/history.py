@@ -0,0 +1,140 @@
+"""
+Deferred writes of the admin history of positions.
+
+History entries logged during a request handled by
+[positions.middleware.PositionHistoryMiddleware] are buffered and, once the
+request's transaction has committed, handed to the POSITION_HISTORY_BACKEND
+to be written with a single bulk insert:
+
+* "queue", the default, writes them from a thread of the process. Entries
+  still queued when the process exits are written before it does.
+* "sync" writes them in the calling thread.
+* any other value is the dotted path to a callable that takes the list of
+  unsaved [LogEntry] instances, e.g. to hand them to a task queue.
+
+Entries logged outside such a request are written right away, in the
+transaction of the caller.
+"""
+import atexit
+import logging
+import threading
+import Queue
+
+from django.contrib.admin.models import LogEntry
+from django.db import close_connection
+from django.utils.encoding import smart_unicode
+from django.utils.importlib import import_module
+
+from positions import settings
+
+logger = logging.getLogger('positions.history')
+
+_local = threading.local()
+
+_queue = Queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start():
+    """
+    Start buffering the history logged in the current thread.
+    """
+    _local.entries = []
+
+
+def discard():
+    """
+    Stop buffering and forget the history logged since [start].
+    """
+    _local.entries = None
+
+
+def flush():
+    """
+    Stop buffering and hand the history logged since [start] to the
+    POSITION_HISTORY_BACKEND. Call it once the changes the history is about
+    are committed.
+    """
+    entries = getattr(_local, 'entries', None)
+    _local.entries = None
+    if entries:
+        write(entries)
+
+
+def log(user_id, content_type_id, object_id, object_repr, action_flag,
+    change_message=''):
+    """
+    Log a history entry, like [LogEntry.objects.log_action]. The entry is
+    buffered between [start] and [flush], and otherwise written right away.
+    The action time of the entry is set when it is written.
+    """
+    entry = LogEntry(user_id=user_id, content_type_id=content_type_id,
+        object_id=smart_unicode(object_id), object_repr=object_repr[:200],
+        action_flag=action_flag, change_message=change_message)
+    entries = getattr(_local, 'entries', None)
+    if entries is not None:
+        entries.append(entry)
+    else:
+        save([entry])
+
+
+def save(entries):
+    """
+    Write the supplied history entries with a single query.
+    """
+    LogEntry.objects.bulk_create(entries)
+
+
+def write(entries):
+    """
+    Hand the supplied history entries to the POSITION_HISTORY_BACKEND.
+    """
+    backend = settings.HISTORY_BACKEND
+    if backend == 'sync':
+        save(entries)
+    elif backend == 'queue':
+        _start_worker()
+        _queue.put(entries)
+    else:
+        module, attr = backend.rsplit('.', 1)
+        getattr(import_module(module), attr)(entries)
+
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work,
+                name='positions-history')
+            _worker.daemon = True
+            _worker.start()
+
+
+def _work():
+    while True:
+        entries = _queue.get()
+        try:
+            save(entries)
+        except Exception:
+            logger.exception('Could not write %s history entries.' %
+                len(entries))
+        finally:
+            close_connection()
+            _queue.task_done()
+
+
+def wait():
+    """
+    Block until the history handed to the "queue" backend is written.
+    """
+    _queue.join()
+
+
+def _drain():
+    # The worker is a daemon thread, write what it has left before the
+    # process exits.
+    if _worker is not None and _worker.is_alive():
+        wait()
+
+atexit.register(_drain)
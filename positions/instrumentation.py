@@ -0,0 +1,124 @@
+"""
+Per request statistics of the work done by positions.
+
+Statistics are only collected between [start] and [stop], which the
+[positions.middleware.PositionStatsMiddleware] and the
+[positions.panels.PositionsDebugPanel] call for each request. They are kept
+per position name and per template tag.
+"""
+import threading
+import time
+from functools import wraps
+
+from django.db import connection
+
+_local = threading.local()
+
+COUNTERS = ('calls', 'queries', 'time', 'cache_hits', 'cache_misses',
+    'template_lookups', 'template_cache_hits', 'renders', 'render_time')
+
+
+def _new_counters():
+    return dict([(name, 0) for name in COUNTERS])
+
+
+def is_active():
+    return getattr(_local, 'stats', None) is not None
+
+
+def start():
+    """
+    Start collecting statistics in the current thread. Calls may be nested,
+    statistics are collected until the outermost [stop].
+    """
+    if not is_active():
+        _local.stats = {'positions': {}, 'tags': {}, 'total': _new_counters()}
+        _local.depth = 0
+        _local.tags = []
+    _local.depth += 1
+
+
+def stop():
+    """
+    Returns the statistics collected since [start].
+    """
+    stats = get_stats()
+    if stats is not None:
+        _local.depth -= 1
+        if not _local.depth:
+            _local.stats = None
+    return stats
+
+
+def get_stats():
+    return getattr(_local, 'stats', None)
+
+
+def incr(position=None, **counts):
+    """
+    Add the supplied counts to the statistics of a position, the template tag
+    being rendered and the totals.
+    """
+    if not is_active():
+        return
+    if position:
+        counters = _local.stats['positions'].setdefault(position,
+            _new_counters())
+        for name, value in counts.items():
+            counters[name] += value
+
+    # The calls, queries and time of template tags are measured by
+    # [track_tag] itself.
+    buckets = [_local.stats['total']]
+    if _local.tags:
+        buckets.append(_local.stats['tags'].setdefault(
+            _local.tags[-1], _new_counters()))
+    for bucket in buckets:
+        for name, value in counts.items():
+            if name not in ('calls', 'queries', 'time'):
+                bucket[name] += value
+
+
+def query_count():
+    # Queries are only recorded while the debug cursor is in use.
+    return len(connection.queries)
+
+
+def track_tag(name):
+    """
+    Decorates the render method of a template tag node to record the time
+    and queries the tag takes.
+    """
+    def decorator(render):
+        @wraps(render)
+        def wrapper(node, context):
+            if not is_active():
+                return render(node, context)
+            _local.tags.append(name)
+            queries, started = query_count(), time.time()
+            try:
+                return render(node, context)
+            finally:
+                counters = _local.stats['tags'].setdefault(name,
+                    _new_counters())
+                counters['calls'] += 1
+                counters['time'] += time.time() - started
+                counters['queries'] += query_count() - queries
+                _local.tags.pop()
+        return wrapper
+    return decorator
+
+
+def summary(stats):
+    """
+    Returns a one line summary of the supplied statistics.
+    """
+    total = stats['total']
+    return ('%s positions, %s tags, %s queries in tags, %.1fms in tags, '
+        'cache %s/%s hits, %s/%s template cache hits, %s renders in %.1fms' % (
+        len(stats['positions']), sum([t['calls'] for t in stats['tags'].values()]),
+        sum([t['queries'] for t in stats['tags'].values()]),
+        sum([t['time'] for t in stats['tags'].values()]) * 1000,
+        total['cache_hits'], total['cache_hits'] + total['cache_misses'],
+        total['template_cache_hits'], total['template_lookups'],
+        total['renders'], total['render_time'] * 1000))
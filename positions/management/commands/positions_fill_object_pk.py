@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from positions.models import PositionContent, integer_pk
+
+
+class Command(BaseCommand):
+    help = ('Fills the object_pk column of existing position content with '
+        'the integer value of object_id.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+            dest='batch_size',
+            help='The number of rows updated per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk, updated = 0, 0
+        while True:
+            rows = list(PositionContent.objects.filter(pk__gt=last_pk,
+                object_pk__isnull=True).order_by('pk').values_list(
+                    'pk', 'object_id')[:batch_size])
+            if not rows:
+                break
+            with transaction.commit_on_success():
+                for pk, object_id in rows:
+                    value = integer_pk(object_id)
+                    if value is not None:
+                        PositionContent.objects.filter(pk=pk).update(
+                            object_pk=value)
+                        updated += 1
+            last_pk = rows[-1][0]
+
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('Filled object_pk of %s position content.\n' %
+                updated)
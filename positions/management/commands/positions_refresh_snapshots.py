@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from positions import settings
+from positions.models import Position
+
+
+class Command(BaseCommand):
+    help = ('Rewrites the snapshot of the content of every position, or '
+        'empties them when POSITION_SNAPSHOTS is off.')
+
+    def handle(self, *args, **options):
+        if not settings.SNAPSHOTS:
+            cleared = Position.objects.exclude(snapshot='').update(snapshot='')
+            if int(options.get('verbosity', 1)):
+                self.stdout.write('Emptied %s snapshots.\n' % cleared)
+            return
+
+        position_ids = list(Position.objects.values_list('pk', flat=True))
+        for position_id in position_ids:
+            with transaction.commit_on_success():
+                Position.objects.refresh_snapshot(position_id)
+
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('Refreshed %s snapshots.\n' %
+                len(position_ids))
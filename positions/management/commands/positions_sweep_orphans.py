@@ -0,0 +1,71 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db.models import AutoField, IntegerField
+
+from django.contrib.contenttypes.models import ContentType
+from positions.models import PositionContent, content_changes
+
+
+class Command(BaseCommand):
+    help = ('Removes the position content whose content object no longer '
+        'exists, in batches per content type.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+            dest='batch_size',
+            help='The number of rows removed per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            default=False,
+            help='Only report the number of orphans.'),
+    )
+
+    def orphans(self, ctype):
+        """
+        Returns the position content of [ctype] whose content object no
+        longer exists, found with a single anti-join against the table of
+        the content type.
+        """
+        items = PositionContent.objects.filter(content_type=ctype)
+        model = ctype.model_class()
+        if model is None:
+            return items
+        pks = model._base_manager.values('pk')
+        # The primary key of a multi-table inheritance child is a one to one
+        # field to the primary key of its parent.
+        pk = model._meta.pk
+        while pk.rel is not None:
+            pk = pk.rel.get_related_field()
+        if isinstance(pk, (AutoField, IntegerField)):
+            # Rows without object_pk are skipped, run
+            # positions_fill_object_pk first.
+            return items.filter(object_pk__isnull=False).exclude(
+                object_pk__in=pks)
+        return items.exclude(object_id__in=pks)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        total = 0
+        ctype_ids = PositionContent.objects.order_by().values_list(
+            'content_type', flat=True).distinct()
+        for ctype in ContentType.objects.filter(pk__in=list(ctype_ids)):
+            orphans = self.orphans(ctype)
+            if options['dry_run']:
+                count = orphans.count()
+            else:
+                count = 0
+                while True:
+                    ids = list(orphans.values_list('pk', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    with content_changes():
+                        PositionContent.objects.filter(pk__in=ids).delete()
+                    count += len(ids)
+            total += count
+            if verbosity > 1 or (verbosity and count):
+                self.stdout.write('%s.%s: %s orphans\n' % (ctype.app_label,
+                    ctype.model, count))
+
+        if verbosity:
+            self.stdout.write('%s %s orphans.\n' % (
+                options['dry_run'] and 'Found' or 'Removed', total))
@@ -0,0 +1,82 @@
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_connection
+
+from positions import caching
+from positions.models import Position
+
+
+def warm(name, render=False):
+    """
+    Cache the content of the named position, and its rendered content if
+    [render]. Returns the name, the number of seconds it took, the number
+    of items and the number of items rendered.
+    """
+    started = time.time()
+    try:
+        items = Position.objects.get_content(name, as_contenttype=False)
+        rendered = 0
+        if render and caching.get_render_timeout(name):
+            for item in items:
+                item.render()
+                rendered += 1
+        return name, time.time() - started, len(items), rendered
+    finally:
+        close_connection()
+
+
+def _warm(args):
+    return warm(*args)
+
+
+class Command(BaseCommand):
+    args = '[position_name ...]'
+    help = ('Fills the cache with the content of all positions, or of the '
+        'named positions, using a pool of threads or processes.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+            help='The number of threads or processes, 0 warms the positions '
+                'one by one in this process.'),
+        make_option('--processes', action='store_true', default=False,
+            help='Use a pool of processes instead of threads.'),
+        make_option('--render', action='store_true', default=False,
+            help='Also cache the rendered content of positions with a '
+                'POSITION_RENDER_CACHE_TIMEOUT.'),
+    )
+
+    def handle(self, *args, **options):
+        if not caching.is_enabled():
+            raise CommandError('POSITION_CACHE_TIMEOUT is 0, there is no '
+                'cache to warm.')
+        if not caching.is_shared():
+            raise CommandError('The cache backend is not shared with the '
+                'processes serving the site, warming it has no effect.')
+
+        names = list(args) or list(Position.objects.values_list('name',
+            flat=True))
+        tasks = [(name, options['render']) for name in names]
+
+        started = time.time()
+        if not options['workers']:
+            results = map(_warm, tasks)
+        else:
+            # Child processes must not share the connection of this one.
+            close_connection()
+            pool_class = options['processes'] and Pool or ThreadPool
+            pool = pool_class(options['workers'])
+            try:
+                results = pool.map(_warm, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        if int(options.get('verbosity', 1)):
+            for name, seconds, count, rendered in results:
+                self.stdout.write('%-40s %10.1fms %5s items %5s rendered\n' % (
+                    name, seconds * 1000, count, rendered))
+            self.stdout.write('Warmed %s positions in %.1fms.\n' % (
+                len(results), (time.time() - started) * 1000))
@@ -0,0 +1,52 @@
+import logging
+
+from django.db import connection
+
+from positions import instrumentation, history
+from positions import settings as position_settings
+
+logger = logging.getLogger('positions.stats')
+
+
+class PositionStatsMiddleware(object):
+    """
+    Collects the statistics of positions for each request and logs a one
+    line summary of them. Queries are only counted while the debug cursor is
+    in use, which is when DEBUG is on, or for every request when
+    POSITION_STATS_COUNT_QUERIES is True.
+    """
+    def process_request(self, request):
+        instrumentation.start()
+        request._positions_debug_cursor = connection.use_debug_cursor
+        if position_settings.STATS_COUNT_QUERIES:
+            connection.use_debug_cursor = True
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_positions_debug_cursor'):
+            return response
+        connection.use_debug_cursor = request._positions_debug_cursor
+        stats = instrumentation.stop()
+        if stats is not None:
+            request.position_stats = stats
+            logger.info('%s %s: %s' % (request.method, request.path,
+                instrumentation.summary(stats)))
+        return response
+
+
+class PositionHistoryMiddleware(object):
+    """
+    Buffers the history entries logged by positions during a request and
+    writes them with a single query when the request is done. Place it
+    before TransactionMiddleware so the entries are handed to the
+    POSITION_HISTORY_BACKEND after the request's transaction commits.
+    Entries are discarded when the view raises an exception.
+    """
+    def process_request(self, request):
+        history.start()
+
+    def process_exception(self, request, exception):
+        history.discard()
+
+    def process_response(self, request, response):
+        history.flush()
+        return response
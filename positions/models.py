@@ -1,19 +1,216 @@
+import bisect
+import copy
 import datetime
-from django.db import models
-from django.db.models import Q
+import threading
+import time
+from contextlib import contextmanager
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.conf import settings as django_settings
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models import F, Q, signals
 from django.utils.translation import ugettext as _
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.template.loader import select_template
 from django.template import Context
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+try:
+    from django.utils import simplejson
+except ImportError:
+    import json as simplejson
+
+from positions import settings, caching, instrumentation
+
+
+def integer_pk(value):
+    """
+    Returns the supplied primary key as an integer, or None if it is not
+    one.
+    """
+    try:
+        integer = int(value)
+    except (TypeError, ValueError):
+        return None
+    if unicode(integer) != unicode(value):
+        return None
+    return integer
+
+
+def _field_values(instance):
+    """
+    Returns the concrete field values of a model instance, suitable for
+    caching and rebuilding the instance later on.
+    """
+    return dict([(f.attname, getattr(instance, f.attname))
+        for f in instance._meta.fields])
+
+
+def _live_items(items, now):
+    """
+    Returns the supplied [PositionContent] instances that are scheduled to be
+    shown at [now], and the time the next of them starts or ends or None.
+    """
+    live, boundary = [], None
+    for item in items:
+        if item.start_date and item.start_date > now:
+            dates = [item.start_date]
+        elif item.end_date and item.end_date <= now:
+            continue
+        else:
+            live.append(item)
+            dates = item.end_date and [item.end_date] or []
+        for date in dates:
+            if boundary is None or date < boundary:
+                boundary = date
+    return live, boundary
+
+
+def _cache_timeout(boundary, now):
+    """
+    Returns the number of seconds content can be cached for when it changes
+    at [boundary].
+    """
+    if boundary is None:
+        return settings.CACHE_TIMEOUT
+    delta = boundary - now
+    seconds = delta.days * 24 * 60 * 60 + delta.seconds + (
+        delta.microseconds and 1 or 0)
+    return max(min(seconds, settings.CACHE_TIMEOUT), 1)
+
+
+# The positions resolved by name in this process, along with the id and
+# version of the position they were read at.
+_positions_by_name = {}
+
+# The eligibility index of the last version read by this process.
+_eligibility_index = {}
+
+# The ids of the content types of all the position content, and the time
+# they are read again. Content types placed by this process are added right
+# away, those placed by other processes are seen when they are read again.
+_placed_types = {}
+PLACED_TYPES_TIMEOUT = 60
+
+# The templates selected to render position content, by the values the
+# template list is built from. Least recently used templates are evicted.
+_template_cache = OrderedDict()
+_template_cache_lock = threading.Lock()
+
+# The number of times add_objects tries to insert objects that are added to
+# the same position at the same time.
+ADD_ATTEMPTS = 3
+
+# The ids of the positions changed by the [content_changes] in progress in
+# this thread.
+_changes = threading.local()
+
+
+def clear_template_cache():
+    """
+    Forget all the templates selected to render position content.
+    """
+    with _template_cache_lock:
+        _template_cache.clear()
+
+
+def _select_template(key, template_list):
+    """
+    A caching version of [select_template]. Templates are selected on every
+    call while TEMPLATE_DEBUG is on so changes to templates show up.
+    """
+    if not settings.TEMPLATE_CACHE_SIZE or django_settings.TEMPLATE_DEBUG:
+        if _template_cache:
+            clear_template_cache()
+        instrumentation.incr(key[1], template_lookups=1)
+        return select_template(template_list)
+
+    with _template_cache_lock:
+        t = _template_cache.pop(key, None)
+        if t is not None:
+            _template_cache[key] = t
+    if t is not None:
+        instrumentation.incr(key[1], template_lookups=1,
+            template_cache_hits=1)
+        return t
+    instrumentation.incr(key[1], template_lookups=1)
+
+    t = select_template(template_list)
+
+    with _template_cache_lock:
+        _template_cache[key] = t
+        while len(_template_cache) > settings.TEMPLATE_CACHE_SIZE:
+            del _template_cache[iter(_template_cache).next()]
+    return t
+
+
+def content_changed(position_id):
+    """
+    Invalidate the cached contents of a position and rewrite its snapshot.
+    """
+    caching.bump_version(position_id)
+    if settings.SNAPSHOTS:
+        Position.objects.refresh_snapshot(position_id)
+
+
+@contextmanager
+def _no_transaction():
+    yield
+
+
+@contextmanager
+def content_changes(position=None, using=None):
+    """
+    Groups changes to the content of a position, or of any position. The
+    positions changed are invalidated and their snapshots rewritten once,
+    when the outermost group ends, instead of for every [PositionContent]
+    saved or deleted.
+
+    Outside a transaction, the outermost group runs in a transaction of the
+    [using] database. The snapshots are rewritten in that transaction and
+    the positions are invalidated after it commits, so a reader cannot cache
+    the content it read before the commit under the new version. Inside the
+    transaction of the caller, the group joins it and the positions are
+    invalidated when the group ends, before the caller commits.
+    """
+    outermost = getattr(_changes, 'position_ids', None) is None
+    if outermost:
+        _changes.position_ids = set()
+    if position is not None:
+        _changes.position_ids.add(position.pk)
+    if not outermost:
+        yield
+        return
+
+    # Committing a transaction managed by the caller would commit the work
+    # of the caller too.
+    if transaction.is_managed(using=using):
+        block = _no_transaction()
+    else:
+        block = transaction.commit_on_success(using=using)
+    try:
+        with block:
+            yield
+            if settings.SNAPSHOTS:
+                for position_id in _changes.position_ids:
+                    Position.objects.refresh_snapshot(position_id)
+    finally:
+        position_ids, _changes.position_ids = _changes.position_ids, None
+        for position_id in position_ids:
+            caching.bump_version(position_id)
 
-from positions import settings
 
 class PositionManager(models.Manager):
 
-    def add_object(self, position, obj, order=1):
+    def add_object(self, position, obj, order=1, start_date=None,
+        end_date=None):
         """
-        Add an object to a position.
+        Add an object to a position, optionally shown only from [start_date]
+        until [end_date].
         """
         # check to make sure position is within the position count.
         if not order in range(1, position.count+1):
@@ -26,21 +223,35 @@ class PositionManager(models.Manager):
         if not self.is_applicable(position, obj):
             return False
 
-        # Create the new PositionContent object, force uniquness.
-        try:
-            PositionContent._default_manager.get(position__pk=position.pk,
-                content_type__pk=ctype.pk, object_id=str(obj.id))
-            return False
-        except PositionContent.DoesNotExist:
-            new_obj = PositionContent._default_manager.create(
-                position=position, content_type=ctype, object_id=obj.pk,
-                order=order, add_date=datetime.datetime.now())
-
-        # Adjust the order of each item
-        PositionContent.objects.reorder(position, new_obj, is_removed=False)
-
-        # Remove extra items
-        PositionContent.objects.prune(position)
+        # The position is changed, and invalidated, once the new content is
+        # saved.
+        with content_changes(using=self.db):
+            # Create the new PositionContent object. The unique constraint
+            # on the position, content type and object id rejects objects
+            # already in the position, also when they are added at the same
+            # time.
+            sid = transaction.savepoint(using=self.db)
+            try:
+                new_obj = PositionContent._default_manager.create(
+                    position=position, content_type=ctype, object_id=obj.pk,
+                    order=order, add_date=datetime.datetime.now(),
+                    start_date=start_date, end_date=end_date)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=self.db)
+                # Only the unique constraint means the object is there.
+                if PositionContent._default_manager.filter(
+                    position=position, content_type=ctype,
+                    object_id=str(obj.pk)).exists():
+                    return False
+                raise
+            transaction.savepoint_commit(sid, using=self.db)
+
+            # Adjust the order of each item
+            PositionContent.objects.reorder(position, new_obj,
+                is_removed=False)
+
+            # Remove extra items
+            PositionContent.objects.prune(position)
 
         return True
 
@@ -50,77 +261,426 @@ class PositionManager(models.Manager):
         """
         # Retrieve the content type for the supplied object.
         ctype = ContentType.objects.get_for_model(obj)
-        try:
-            item = PositionContent._default_manager.get(position=position,
-                content_type=ctype, object_id=str(obj.pk))
-        except PositionContent.DoesNotExist:
-            return False
 
-        # Adjust the order of each item
-        PositionContent.objects.reorder(position, item, is_removed=True)
-        item.delete()
+        with content_changes(using=self.db):
+            # Lock the item only, so an object removed at the same time is
+            # only removed, and the order adjusted, once.
+            try:
+                item = PositionContent._default_manager.select_for_update(
+                    ).get(position=position, content_type=ctype,
+                        object_id=str(obj.pk))
+            except PositionContent.DoesNotExist:
+                return False
+
+            # Adjust the order of each item
+            PositionContent.objects.reorder(position, item, is_removed=True)
+            item.delete()
 
         return True
 
-    def get_content(self, position, count=None, as_contenttype=True):
+    def add_objects(self, position, objs, order=1, start_date=None,
+        end_date=None):
         """
-        Retreives the content a supplied position contains.
+        Add several objects to a position, in the order they are supplied,
+        starting at [order], optionally shown only from [start_date] until
+        [end_date]. Returns the objects that were added.
         """
-        items = []
-        if isinstance(position, basestring):
-            items = PositionContent._default_manager.filter(
-                position__name__iexact=position).select_related(
-                    ).order_by('order')
-        elif isinstance(position, Position):
-            items = PositionContent._default_manager.filter(
-                position=position).select_related().order_by('order')
-
-        # Filter out any contents that are missing the content object. This
-        # may happen when a content object is deleted
-        items = filter(lambda i: i.content_object is not None, items)
-
-        # If items is empty return an empty list
-        if not items:
+        # check to make sure position is within the position count.
+        if not order in range(1, position.count+1):
+            order = 1
+
+        # Ensure that the position allows the objects, once per content type.
+        applicable, candidates = {}, []
+        for obj in objs:
+            ctype = ContentType.objects.get_for_model(obj)
+            if ctype.pk not in applicable:
+                applicable[ctype.pk] = self.is_applicable(position, obj)
+            if applicable[ctype.pk]:
+                candidates.append((ctype, obj))
+        if not candidates:
             return []
 
-        # Get the position, this is a way around making a
-        # another query to get the position.
-        pos = items[0].position
+        with content_changes(position, using=self.db):
+            # Objects added by others at the same time make the insert
+            # fail on the unique constraint, try again without them.
+            for attempt in range(ADD_ATTEMPTS):
+                sid = transaction.savepoint(using=self.db)
+                try:
+                    added = self._insert_objects(position, candidates,
+                        order, start_date, end_date)
+                except IntegrityError:
+                    transaction.savepoint_rollback(sid, using=self.db)
+                    if attempt == ADD_ATTEMPTS - 1:
+                        raise
+                else:
+                    transaction.savepoint_commit(sid, using=self.db)
+                    break
 
-        # If [as_contenttype] is [True], return the content objects
-        # for each item, instead of the [PositionContent] instances
-        if as_contenttype:
-            ctypes, tmp_dict = {}, {}
-            # Build a list of object_id's by content type
-            for item in items:
-                if item.content_type not in ctypes:
-                    ctypes[item.content_type] = []
+            # Remove extra items
+            if added:
+                PositionContent.objects.prune(position)
+
+        return added
+
+    def _insert_objects(self, position, candidates, order, start_date,
+        end_date):
+        """
+        Insert the supplied content types and objects that are not in the
+        position yet at [order]. Returns the objects that were inserted.
+        """
+        # Force uniquness against the current content in a single query.
+        existing = set(PositionContent._default_manager.filter(
+            position=position).values_list('content_type', 'object_id'))
+
+        added, new_objs = [], []
+        now = datetime.datetime.now()
+        for ctype, obj in candidates:
+            key = (ctype.pk, unicode(obj.pk))
+            if key in existing:
+                continue
+            existing.add(key)
+            added.append(obj)
+            new_objs.append(PositionContent(position=position,
+                content_type=ctype, object_id=obj.pk,
+                object_pk=integer_pk(obj.pk), order=order + len(new_objs),
+                add_date=now, start_date=start_date, end_date=end_date))
+
+        if new_objs:
+            # Make room for the new items
+            PositionContent._default_manager.filter(position=position,
+                order__gte=order).update(order=F('order') + len(new_objs))
+            PositionContent._default_manager.bulk_create(new_objs)
+            PositionContent.objects.add_placed_types(
+                [item.content_type_id for item in new_objs])
+        return added
+
+    def remove_objects(self, position, objs):
+        """
+        Remove several objects from a position. Returns the objects that were
+        removed.
+        """
+        objs_by_key = dict([((ContentType.objects.get_for_model(obj).pk,
+            unicode(obj.pk)), obj) for obj in objs])
+
+        with content_changes(using=self.db):
+            items = list(PositionContent._default_manager.filter(
+                position=position).order_by('order').values_list(
+                    'pk', 'content_type', 'object_id', 'order'))
+
+            removed, removed_orders = [], []
+            for pk, ctype_id, object_id, order in items:
+                if (ctype_id, object_id) in objs_by_key:
+                    removed.append(pk)
+                    removed_orders.append(order)
+            if not removed:
+                return []
+
+            # Subtract the number of removed items before each item left
+            orders = {}
+            for pk, ctype_id, object_id, order in items:
+                shift = bisect.bisect_left(removed_orders, order)
+                if pk not in removed and shift:
+                    orders[pk] = order - shift
+
+            PositionContent.objects.set_order(position, orders, removed)
+
+        return [objs_by_key[(ctype_id, object_id)]
+            for pk, ctype_id, object_id, order in items if pk in removed]
+
+    def refresh_snapshot(self, position_id):
+        """
+        Rewrite the snapshot of the ordered content of a position.
+        """
+        rows = PositionContent._default_manager.filter(
+            position=position_id).order_by('order', '-add_date').values_list(
+                'pk', 'content_type', 'object_id', 'order', 'add_date',
+                'start_date', 'end_date')
+        snapshot = simplejson.dumps([list(row[:4]) + [date and date.isoformat()
+            for date in row[4:]] for row in rows], separators=(',', ':'))
+        self.filter(pk=position_id).update(snapshot=snapshot)
+
+    def _items_from_snapshot(self, pos):
+        """
+        Rebuild the [PositionContent] instances of a position from its
+        snapshot.
+        """
+        items = []
+        for row in simplejson.loads(pos.snapshot):
+            pk, ctype_id, object_id, order = row[:4]
+            add_date, start_date, end_date = [date and parse_datetime(date)
+                for date in row[4:]]
+            item = PositionContent(pk=pk, position=pos,
+                content_type=ContentType.objects.get_for_id(ctype_id),
+                object_id=object_id, object_pk=integer_pk(object_id),
+                order=order, add_date=add_date, start_date=start_date,
+                end_date=end_date)
+            items.append(item)
+        return items
+
+    def _resolve_positions(self, positions):
+        """
+        Returns a dictionary of each supplied position name or instance and
+        the id of that position, 0 for positions that do not exist.
+        """
+        position_ids, names = {}, []
+        for position in positions:
+            if isinstance(position, Position):
+                position_ids[position] = position.pk
+            elif isinstance(position, basestring):
+                position_id = caching.get_position_id(position)
+                if position_id is None:
+                    names.append(position)
+                else:
+                    position_ids[position] = position_id
+            else:
+                position_ids[position] = 0
+
+        if names:
+            found = self._find_names(names)
+            for name in names:
+                position_ids[name] = found.get(name.lower(), 0)
+                caching.set_position_id(name, position_ids[name])
+
+        return position_ids
+
+    def _find_names(self, names):
+        """
+        Returns a dictionary of the lower cased names of the positions with
+        the supplied names and their ids. Names are matched exactly first,
+        which can use the index on name, and only the names not found are
+        matched case insensitive.
+        """
+        found = dict([(name.lower(), pk) for name, pk in self.filter(
+            name__in=names).values_list('name', 'pk')])
+
+        rest = [name for name in names if name.lower() not in found]
+        if rest:
+            query = Q()
+            for name in rest:
+                query |= Q(name__iexact=name)
+            found.update(dict([(name.lower(), pk) for name, pk in self.filter(
+                query).values_list('name', 'pk')]))
+        return found
+
+    def _query_by_name(self, name):
+        """
+        Returns the position with the supplied name or None, preferring an
+        exact match over a case insensitive one, with a single query.
+        """
+        positions = list(self.filter(name__iexact=name))
+        for pos in positions:
+            if pos.name == name:
+                return pos
+        return positions and positions[0] or None
+
+    def get_by_name(self, name):
+        """
+        Returns the position with the supplied name, matched case
+        insensitive, or None if there is no such position.
+
+        Positions are kept in the process by name and reused for as long as
+        the cached version of the position does not change, so resolving a
+        position by name does not query the database in steady state.
+        """
+        if not caching.is_enabled():
+            return self._query_by_name(name)
+
+        key = name.lower()
+        position_id = caching.get_position_id(name)
+        if position_id == 0:
+            return None
+        if position_id is not None:
+            version = caching.get_version(position_id)
+            entry = _positions_by_name.get(key)
+            if entry is not None and entry[0] == (position_id, version):
+                return copy.copy(entry[1])
+
+        pos = self._query_by_name(name)
+        caching.set_position_id(name, pos and pos.pk or 0)
+        if pos is None:
+            return None
+        _positions_by_name[key] = ((pos.pk, caching.get_version(pos.pk)), pos)
+        return copy.copy(pos)
+
+    def _get_items_many(self, positions):
+        """
+        Returns a dictionary of each supplied position name or instance and a
+        tuple of the position and its ordered [PositionContent] instances.
+        The content of positions that are not cached is read from their
+        snapshots when POSITION_SNAPSHOTS is on, or else retrieved with a
+        single query.
+
+        Only the content scheduled to be shown now is returned. The content
+        is cached until the next scheduled content starts or ends.
+        """
+        position_ids = self._resolve_positions(positions)
+        instances = dict([(p.pk, p) for p in positions
+            if isinstance(p, Position)])
+
+        found, missing = {}, {}
+        for position_id in set(position_ids.values()):
+            if not position_id:
+                continue
+            version = None
+            if caching.is_enabled():
+                version = caching.get_version(position_id)
+                data = caching.get_content(position_id, version)
+                if data is not None:
+                    found[position_id] = self._items_from_cache(
+                        instances.get(position_id), data)
+                    instrumentation.incr(found[position_id][0].name,
+                        cache_hits=1)
+                    continue
+            missing[position_id] = version
+
+        if missing:
+            now = timezone.now()
+            items_by_position = {}
+            if settings.SNAPSHOTS:
+                # The snapshots of supplied positions may be out of date.
+                for position_id, pos in self.in_bulk(missing.keys()).items():
+                    instances.setdefault(position_id, pos)
+                    if pos.snapshot:
+                        items_by_position[position_id] = \
+                            self._items_from_snapshot(pos)
+            else:
+                unknown = [pk for pk in missing if pk not in instances]
+                if unknown:
+                    instances.update(self.in_bulk(unknown))
+
+            rest = [pk for pk in missing if pk not in items_by_position]
+            if rest:
+                items_by_position.update(dict([(pk, []) for pk in rest]))
+                # Content that has not started yet is retrieved to know when
+                # it does.
+                for item in PositionContent._default_manager.filter(
+                    Q(end_date__isnull=True) | Q(end_date__gt=now),
+                    position__in=rest).select_related(
+                        'content_type').order_by('order', '-add_date'):
+                    items_by_position[item.position_id].append(item)
+
+            for position_id, version in missing.items():
+                pos = instances.get(position_id)
+                if pos is None:
+                    continue
+                items, boundary = _live_items(
+                    items_by_position.get(position_id, []), now)
+                for item in items:
+                    item.position = pos
+                found[position_id] = (pos, items)
+                if version is not None:
+                    instrumentation.incr(pos.name, cache_misses=1)
+                    caching.set_content(position_id, version, (
+                        _field_values(pos),
+                        [_field_values(item) for item in items]),
+                        _cache_timeout(boundary, now))
+
+        return dict([(position, found.get(position_id, (None, [])))
+            for position, position_id in position_ids.items()])
+
+    def _items_from_cache(self, pos, data):
+        """
+        Rebuild the position and its [PositionContent] instances from the
+        field values stored in the cache.
+        """
+        pos_values, item_values = data
+        if pos is None:
+            pos = Position(**pos_values)
+
+        items = []
+        for values in item_values:
+            item = PositionContent(**values)
+            item.position = pos
+            item.content_type = ContentType.objects.get_for_id(
+                item.content_type_id)
+            items.append(item)
+        return pos, items
+
+    def _get_content_objects(self, items):
+        """
+        Returns a dictionary of the content objects of the supplied
+        [PositionContent] instances, retrieved with a single query per
+        content type.
+        """
+        ctypes, content_objects = {}, {}
+        # Build a list of object_id's by content type, integers when possible
+        for item in items:
+            if item.content_type not in ctypes:
+                ctypes[item.content_type] = []
+            if item.object_pk is not None:
+                ctypes[item.content_type].append(item.object_pk)
+            else:
                 ctypes[item.content_type].append(item.object_id)
 
-            ctype_key = "%s_%s_%s"
-            for ctype, object_ids in ctypes.items():
-                # Retreive all the objects by content type
-                qs = ctype.model_class().objects.filter(pk__in=object_ids)
+        for ctype, object_ids in ctypes.items():
+            model = ctype.model_class()
+            if model is None:
+                continue
 
-                # Build a temp dictionary so we can order the items
-                # correctly later on.
-                tmp_dict.update(dict([(ctype_key % (
-                    ctype.app_label,
-                    ctype.model,
-                    str(item.pk)), item) for item in qs]))
+            # Retreive all the objects by content type
+            qs = model.objects.filter(pk__in=object_ids)
 
-            # Loop all the items, which is in the correct order we expect,
-            # and retreive the item from our temp dictionary
-            try:
-                items = [tmp_dict[ctype_key % (
-                    i.content_type.app_label,
-                    i.content_type.model,
-                    str(i.object_id))] for i in items]
-            except KeyError:
-                return []
+            # Build a temp dictionary so we can order the items
+            # correctly later on.
+            content_objects.update(dict([((ctype.pk, unicode(obj.pk)), obj)
+                for obj in qs]))
+        return content_objects
+
+    def get_content(self, position, count=None, as_contenttype=True):
+        """
+        Retreives the content a supplied position contains.
+        """
+        return self.get_content_many([position], count, as_contenttype)[position]
 
-        num = count or pos.count
-        return items[:num]
+    def get_content_many(self, positions, count=None, as_contenttype=True):
+        """
+        Retreives the content of several positions at once. Returns a
+        dictionary of each supplied position name or instance and its content.
+        """
+        if instrumentation.is_active():
+            queries, started = instrumentation.query_count(), time.time()
+
+        items_by_position = self._get_items_many(positions)
+        content_objects = self._get_content_objects([item
+            for pos, items in items_by_position.values() for item in items])
+
+        contents = {}
+        for position, (pos, items) in items_by_position.items():
+            result = []
+            for item in items:
+                key = (item.content_type_id, unicode(item.object_id))
+                # Skip any contents that are missing the content object.
+                # Deleted objects are removed from positions, but may be
+                # deleted without signals, until positions_sweep_orphans
+                # runs.
+                if key not in content_objects:
+                    continue
+
+                # If [as_contenttype] is [True], return the content objects
+                # for each item, instead of the [PositionContent] instances
+                if as_contenttype:
+                    result.append(content_objects[key])
+                else:
+                    setattr(item, PositionContent.content_object.cache_attr,
+                        content_objects[key])
+                    result.append(item)
+
+            num = count or (pos and pos.count)
+            contents[position] = result[:num]
+
+        if instrumentation.is_active():
+            # The queries are only attributed to a position when it is the
+            # only one retrieved.
+            for position, (pos, items) in items_by_position.items():
+                if pos is None:
+                    continue
+                counts = {'calls': 1}
+                if len(items_by_position) == 1:
+                    counts['queries'] = (instrumentation.query_count() -
+                        queries)
+                    counts['time'] = time.time() - started
+                instrumentation.incr(pos.name, **counts)
+        return contents
 
     def contains_object(self, position, obj):
         """
@@ -152,20 +712,64 @@ class PositionManager(models.Manager):
             positioncontent__object_id=str(obj.pk)).distinct()
 
 
+    def get_eligibility(self):
+        """
+        Returns a dictionary of content type ids and the ids of the positions
+        that are eligible for that content type, and the ids of the positions
+        that allow all types, or None if caching is disabled.
+
+        The index is kept in the cache and in the process, and rebuilt after
+        the eligible types of any position change.
+        """
+        if not caching.is_enabled():
+            return None
+
+        version = caching.get_version(caching.ELIGIBILITY)
+        if _eligibility_index.get('version') != version:
+            index = caching.get_content(caching.ELIGIBILITY, version)
+            if index is None:
+                eligible = {}
+                through = self.model.eligible_types.through
+                for ctype_id, position_id in through._default_manager.values_list(
+                    'contenttype', 'position'):
+                    eligible.setdefault(ctype_id, set()).add(position_id)
+                allow_all = set(self.filter(
+                    allow_all_types=True).values_list('pk', flat=True))
+                index = (eligible, allow_all)
+                caching.set_content(caching.ELIGIBILITY, version, index)
+            _eligibility_index.update(version=version, index=index)
+        return _eligibility_index['index']
+
+    def _applicable_ids(self, ctype):
+        """
+        Returns the ids of the positions that allow the supplied content type
+        or None if caching is disabled.
+        """
+        index = self.get_eligibility()
+        if index is None:
+            return None
+        eligible, allow_all = index
+        return eligible.get(ctype.pk, set()) | allow_all
+
     def get_applicable(self, obj, return_all=False):
         """
         Gets the positions that the object can be assigned.
         """
         ctype = ContentType.objects.get_for_model(obj)
 
-        if return_all:
+        position_ids = self._applicable_ids(ctype)
+        if position_ids is None:
             positions = self.filter(
                 Q(eligible_types__in=[ctype,]) | Q(allow_all_types=True))
+        elif position_ids:
+            positions = self.filter(pk__in=position_ids)
         else:
-            positions = self.filter(
-                Q(eligible_types__in=[ctype,]) | Q(allow_all_types=True)).exclude(
-                    positioncontent__content_type=ctype,
-                    positioncontent__object_id=str(obj.pk))
+            return self.none()
+
+        if not return_all:
+            positions = positions.exclude(
+                positioncontent__content_type=ctype,
+                positioncontent__object_id=str(obj.pk))
 
         return positions
 
@@ -177,6 +781,10 @@ class PositionManager(models.Manager):
             return True
 
         ctype = ContentType.objects.get_for_model(obj)
+        position_ids = self._applicable_ids(ctype)
+        if position_ids is not None:
+            return position.pk in position_ids
+
         items = self.filter(pk=position.pk,
             eligible_types__in=[ctype,]).count()
 
@@ -189,6 +797,9 @@ class PositionManager(models.Manager):
         Check to see if any positions can position the supplied object.
         """
         ctype = ContentType.objects.get_for_model(obj)
+        position_ids = self._applicable_ids(ctype)
+        if position_ids is not None:
+            return bool(position_ids)
 
         items = self.filter(
             Q(eligible_types__in=[ctype,]) | Q(allow_all_types=True))
@@ -213,6 +824,9 @@ class Position(models.Model):
         default=False,
         help_text=_('Select this check box if this position should allow all types of content.'))
     description = models.TextField(_('Description'), blank=True)
+    snapshot = models.TextField(_('Snapshot'), blank=True, editable=False,
+        help_text=_('The ordered content of the position, kept when '
+            'POSITION_SNAPSHOTS is on.'))
 
     objects = PositionManager()
 
@@ -225,46 +839,109 @@ class Position(models.Model):
 
 class PositionContentManager(models.Manager):
 
-    def prune(self, position):
+    def placed_types(self):
         """
-        Trim the amount of items in the position.
+        Returns the ids of the content types of all the position content.
+        They are kept in the process for PLACED_TYPES_TIMEOUT seconds.
         """
-        # Get all the items in the correct order.
-        items = self.filter(position=position).order_by('order')
-
-        # If the total of items is greater than the position count plus the
-        # CONTENT_OVERLAP_COUNT, retrieve the excess items and delete them
-        if len(items) > position.count + settings.CONTENT_OVERLAP_COUNT:
+        now = time.time()
+        if _placed_types.get('expires', 0) <= now:
+            ids = set(self.order_by().values_list('content_type',
+                flat=True).distinct())
+            _placed_types.update(ids=ids, expires=now + PLACED_TYPES_TIMEOUT)
+        return _placed_types['ids']
+
+    def add_placed_types(self, ctype_ids):
+        """
+        Add the ids of content types placed in a position to the ones kept
+        in the process.
+        """
+        if 'ids' in _placed_types:
+            _placed_types['ids'].update(ctype_ids)
 
-            # Retrieve all the ids of PositionContent after the
-            # position.count + CONTENT_OVERMAP_COUNT
-            ids = [i.pk for i in items[
-                (position.count + settings.CONTENT_OVERLAP_COUNT):]]
+    def matching(self, position, queryset):
+        """
+        Returns the ordered content of a position whose content object is
+        part of the supplied queryset, e.g. only the published entries. The
+        content is joined to the queryset in SQL through [object_pk].
+        """
+        ctype = ContentType.objects.get_for_model(queryset.model)
+        return self.filter(position=position, content_type=ctype,
+            object_pk__in=queryset.values('pk')).order_by('order', '-add_date')
 
-            # Remove, if any, the items left over.
-            if ids:
+    def prune(self, position):
+        """
+        Trim the amount of items in the position.
+        """
+        # Retrieve all the ids of PositionContent after the
+        # position.count + CONTENT_OVERLAP_COUNT and delete them. Content
+        # scheduled to start later is neither counted nor deleted.
+        limit = position.count + settings.CONTENT_OVERLAP_COUNT
+        ids = list(self.filter(position=position).exclude(
+            start_date__gt=timezone.now()).order_by(
+            'order', '-add_date').values_list('pk', flat=True)[limit:])
+
+        # Remove, if any, the items left over.
+        if ids:
+            with content_changes(position):
                 self.filter(pk__in=ids).delete()
 
-
     def reorder(self, position, existing_item, is_removed=False):
         """
         Reorder the content after a new content object is removed or added.
         """
-        for item in self.filter(position=position).order_by('order'):
-            # Only update the item order if it is not the supplied item.
-            if item != existing_item:
+        items = self.filter(position=position).exclude(pk=existing_item.pk)
+
+        # Add 1 to all items after the supplied new item, which should always
+        # be the first item or subtract 1 for items after the supplied item
+        # if the item is marked for removal.
+        with content_changes(position):
+            if is_removed:
+                items.filter(order__gt=existing_item.order).update(
+                    order=F('order') - 1)
+            else:
+                items.filter(order__gte=existing_item.order).update(
+                    order=F('order') + 1)
+
+    def set_order(self, position, orders, removed=()):
+        """
+        Apply a new order to the content of a position.
 
-                # Add 1 to all items after the supplied new item, which
-                # should always be the first item or subtract 1 for items
-                # after the supplied item if the item is marked for removal.
-                if is_removed:
-                    if item.order > existing_item.order:
-                        item.order -= 1
-                else:
-                    if item.order >= existing_item.order:
-                        item.order += 1
+        [orders] maps the ids of [PositionContent] instances to their new
+        order, the instances with ids in [removed] are deleted, in a single
+        transaction.
+        """
+        with content_changes(position, using=self.db):
+            if orders:
+                self._update_order(position, orders)
+            if removed:
+                self.filter(position=position, pk__in=removed).delete()
 
-                item.save()
+    def _update_order(self, position, orders):
+        """
+        Write the new order of the content of a position with a single
+        UPDATE statement.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        cases, params = [], []
+        for pk, order in orders.items():
+            cases.append('WHEN %s THEN %s')
+            params.extend([pk, order])
+        params.append(position.pk)
+        params.extend(orders.keys())
+        cursor = connection.cursor()
+        cursor.execute('UPDATE %s SET %s = CASE %s %s END '
+            'WHERE %s = %%s AND %s IN (%s)' % (
+                qn(opts.db_table),
+                qn(opts.get_field('order').column),
+                qn(opts.pk.column),
+                ' '.join(cases),
+                qn(opts.get_field('position').column),
+                qn(opts.pk.column),
+                ', '.join(['%s'] * len(orders))), params)
+        transaction.set_dirty(using=self.db)
 
 
 class PositionContent(models.Model):
@@ -278,21 +955,46 @@ class PositionContent(models.Model):
         help_text=_('Type of this object.'))
     object_id = models.CharField(_('Object ID'), max_length=255,
         help_text=_('The ID/PK of the object.'))
+    object_pk = models.BigIntegerField(_('Object PK'), null=True, blank=True,
+        db_index=True, editable=False,
+        help_text=_('The ID/PK of the object if it is an integer, used to '
+            'join the object in SQL.'))
     content_object = generic.GenericForeignKey('content_type', 'object_id')
     order = models.PositiveIntegerField(_('Order'), default=1,
         help_text=_('The order of the object.'))
     add_date = models.DateTimeField(_('Date Added'),
         default=datetime.datetime.now)
+    start_date = models.DateTimeField(_('Start Date'), null=True, blank=True,
+        db_index=True,
+        help_text=_('The object is not shown before this date.'))
+    end_date = models.DateTimeField(_('End Date'), null=True, blank=True,
+        db_index=True,
+        help_text=_('The object is not shown from this date on.'))
 
     objects = PositionContentManager()
 
     class Meta:
         ordering = ['position__name', 'order', '-add_date']
 
-    def render(self, template=None, suffix=None, extra_context={},
-        context_instance=None):
+    def _get_unique_checks(self, exclude=None):
+        # The position, content type and object id are unique. The constraint
+        # is created by the custom SQL instead of unique_together, so MySQL
+        # can index a prefix of the object id, and checked like it here.
+        unique_checks, date_checks = super(PositionContent,
+            self)._get_unique_checks(exclude)
+        fields = ('position', 'content_type', 'object_id')
+        if not [name for name in fields if name in (exclude or [])]:
+            unique_checks.append((PositionContent, fields))
+        return unique_checks, date_checks
+
+    def save(self, *args, **kwargs):
+        self.object_pk = integer_pk(self.object_id)
+        super(PositionContent, self).save(*args, **kwargs)
+
+    def get_template_list(self, template=None, suffix=None):
         """
-        Render the content using template search in the following order:
+        Returns the templates to render the content with in the following
+        order:
 
         1. Supplied template
         2. positions/render/<position>/<app><combine_string><model><combine_string><suffix>.html
@@ -301,8 +1003,6 @@ class PositionContent(models.Model):
         5. positions/render/<position>/default.html
         6. positions/render/default.html
         """
-        t, model, app = None, "", ""
-
         model = self.content_type.model.lower()
         app = self.content_type.app_label.lower()
 
@@ -337,10 +1037,40 @@ class PositionContent(models.Model):
         # default path + default template
         template_list.append(default_tmpl_path % default_tmpl)
 
-        t = select_template(template_list)
+        return template_list
+
+    def get_template(self, template=None, suffix=None):
+        """
+        Returns the first template of [get_template_list] that exists. The
+        selected template is cached for every combination of the values the
+        template list is built from.
+        """
+        key = (template, self.position.name, self.content_type.app_label,
+            self.content_type.model, suffix, settings.CONBINE_STRING)
+        return _select_template(key, self.get_template_list(template, suffix))
+
+    def render(self, template=None, suffix=None, extra_context={},
+        context_instance=None):
+        """
+        Render the content using the first template of [get_template_list]
+        that exists.
+        """
+        started = time.time()
+        t = self.get_template(template, suffix)
         if not t:
             return None
 
+        # The rendered content is cached per position version, so it is
+        # rendered again whenever the position changes.
+        timeout = not extra_context and caching.get_render_timeout(
+            self.position.name)
+        if timeout:
+            content = caching.get_fragment(self, t.name, suffix)
+            if content is not None:
+                instrumentation.incr(self.position.name, cache_hits=1,
+                    renders=1, render_time=time.time() - started)
+                return content
+
         context = Context()
         if context_instance:
             context.update(context_instance.__dict__)
@@ -348,7 +1078,90 @@ class PositionContent(models.Model):
         context.update({'obj': self.content_object, 'content': self})
         context.update(extra_context)
 
-        return t.render(context)
+        content = t.render(context)
+        if timeout:
+            caching.set_fragment(self, t.name, suffix, content, timeout)
+            instrumentation.incr(self.position.name, cache_misses=1)
+        instrumentation.incr(self.position.name, renders=1,
+            render_time=time.time() - started)
+        return content
 
     def __unicode__(self):
         return '%s - %s' % (self.position.name, self.content_object)
+
+
+def position_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached contents of a saved or deleted position.
+    """
+    caching.delete_position_id(instance.name)
+    caching.bump_version(instance.pk)
+    caching.bump_version(caching.ELIGIBILITY)
+    _positions_by_name.pop(instance.name.lower(), None)
+
+    # The snapshot saved with the position may be out of date.
+    if settings.SNAPSHOTS and kwargs.get('signal') is signals.post_save:
+        Position.objects.refresh_snapshot(instance.pk)
+
+
+def eligible_types_changed(sender, instance, **kwargs):
+    """
+    Invalidate the eligibility index when the eligible types of a position
+    change.
+    """
+    if kwargs.get('action') in ('post_add', 'post_remove', 'post_clear'):
+        caching.bump_version(caching.ELIGIBILITY)
+
+
+def position_renamed(sender, instance, raw=False, **kwargs):
+    """
+    Forget the id cached for the old name of a position.
+    """
+    if raw or not instance.pk:
+        return
+    for name in Position._default_manager.filter(pk=instance.pk).values_list(
+        'name', flat=True):
+        if name != instance.name:
+            caching.delete_position_id(name)
+            _positions_by_name.pop(name.lower(), None)
+
+
+def position_content_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached contents of the position a [PositionContent] was
+    saved to or deleted from, once the changes it is part of are done.
+    """
+    if kwargs.get('signal') is signals.post_save:
+        PositionContent.objects.add_placed_types([instance.content_type_id])
+    position_ids = getattr(_changes, 'position_ids', None)
+    if position_ids is not None:
+        position_ids.add(instance.position_id)
+    else:
+        content_changed(instance.position_id)
+
+def content_object_deleted(sender, instance, **kwargs):
+    """
+    Remove a deleted object from the positions it is in, if there is
+    position content of its type.
+    """
+    if sender in (Position, PositionContent, ContentType) or \
+        sender._meta.auto_created:
+        return
+    ctype = ContentType.objects.get_for_model(sender)
+    if ctype.pk not in PositionContent.objects.placed_types():
+        return
+    # Joins the transaction the object is deleted in, so the positions are
+    # invalidated before it commits. A reader in between may cache the
+    # content with the deleted object, which is skipped when it is read.
+    with content_changes():
+        PositionContent._default_manager.filter(content_type=ctype,
+            object_id=unicode(instance.pk)).delete()
+
+signals.pre_save.connect(position_renamed, sender=Position)
+signals.post_save.connect(position_changed, sender=Position)
+signals.post_delete.connect(position_changed, sender=Position)
+signals.m2m_changed.connect(eligible_types_changed,
+    sender=Position.eligible_types.through)
+signals.post_save.connect(position_content_changed, sender=PositionContent)
+signals.post_delete.connect(position_content_changed, sender=PositionContent)
+signals.post_delete.connect(content_object_deleted)
@@ -0,0 +1,49 @@
+from django.template.loader import render_to_string
+try:
+    from debug_toolbar.panels import DebugPanel
+except ImportError:
+    DebugPanel = None
+
+from positions import instrumentation
+
+if DebugPanel is not None:
+    class PositionsDebugPanel(DebugPanel):
+        """
+        A django-debug-toolbar panel showing the statistics of positions for
+        the current request.
+        """
+        name = 'Positions'
+        has_content = True
+
+        def __init__(self, *args, **kwargs):
+            super(PositionsDebugPanel, self).__init__(*args, **kwargs)
+            self.stats = None
+
+        def nav_title(self):
+            return 'Positions'
+
+        def nav_subtitle(self):
+            if self.stats is None:
+                return ''
+            total = self.stats['total']
+            return '%s renders, %s/%s cache hits' % (total['renders'],
+                total['cache_hits'], total['cache_hits'] + total['cache_misses'])
+
+        def title(self):
+            return 'Positions'
+
+        def url(self):
+            return ''
+
+        def process_request(self, request):
+            instrumentation.start()
+
+        def process_response(self, request, response):
+            self.stats = instrumentation.stop()
+
+        def content(self):
+            stats = self.stats or {'positions': {}, 'tags': {}}
+            return render_to_string('positions/debug_panel.html', {
+                'summary': self.stats and instrumentation.summary(self.stats),
+                'positions': sorted(stats['positions'].items()),
+                'tags': sorted(stats['tags'].items())})
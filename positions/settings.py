@@ -13,6 +13,65 @@ UPDATE_OBJECT_HISTORY = getattr(settings, 'POSITION_UPDATE_OBJECT_HISTORY', Fals
 # Setting that if True wil Update the posistion history if posistion content is added
 # removed or re-ordered
 UPDATE_POSITION_HISTORY = getattr(settings, 'POSITION_UPDATE_POSITION_HISTORY', False)
+
+# Number of seconds the ordered contents of a position are cached. The cache
+# is versioned per position, so changes are visible immediately as long as
+# every process shares the cache backend. Disabled by default.
+CACHE_TIMEOUT = getattr(settings, 'POSITION_CACHE_TIMEOUT', 0)
+
+# Prefix used for all the cache keys set by positions
+CACHE_PREFIX = getattr(settings, 'POSITION_CACHE_PREFIX', 'positions')
+
+# The maximum number of templates selected to render position content that
+# are kept in memory. Templates are always selected again when TEMPLATE_DEBUG
+# is on. Set to 0 to disable.
+TEMPLATE_CACHE_SIZE = getattr(settings, 'POSITION_TEMPLATE_CACHE_SIZE', 500)
+
+# Number of seconds rendered position content is cached, 0 disables the
+# cache. POSITION_RENDER_CACHE_TIMEOUTS overrides it per position name.
+# Rendered content must not depend on the context it is rendered in. Only
+# used when POSITION_CACHE_TIMEOUT is set.
+RENDER_CACHE_TIMEOUT = getattr(settings, 'POSITION_RENDER_CACHE_TIMEOUT', 0)
+RENDER_CACHE_TIMEOUTS = getattr(settings, 'POSITION_RENDER_CACHE_TIMEOUTS', {})
+
+# A callable, or the dotted path to one, returning a token that changes
+# whenever a content object changes. Rendered content is cached per token.
+# The default uses the "modified" attribute of the content object.
+CONTENT_VERSION = getattr(settings, 'POSITION_CONTENT_VERSION', None)
+
+# Whether PositionStatsMiddleware turns on the debug cursor to count the
+# queries made during a request. The debug cursor keeps every query of the
+# request in memory, so only turn it on while investigating.
+STATS_COUNT_QUERIES = getattr(settings, 'POSITION_STATS_COUNT_QUERIES', False)
+
+# Whether a snapshot of the ordered content of every position is kept on the
+# position, so the content of a position is read from a single row.
+SNAPSHOTS = getattr(settings, 'POSITION_SNAPSHOTS', False)
+
+# The serializers used by the content JSON view, by "app_label.model". A
+# serializer is a callable, or the dotted path to one, that takes a content
+# object and returns a dictionary. The default returns the id, the unicode
+# representation and the absolute url of the object.
+SERIALIZERS = getattr(settings, 'POSITION_SERIALIZERS', {})
+
+# How the json_data autocomplete matches the term against position names,
+# "istartswith" or "icontains", the maximum number of positions it returns
+# and the number of seconds its results are cached when POSITION_CACHE_TIMEOUT
+# is set.
+AUTOCOMPLETE_LOOKUP = getattr(settings, 'POSITION_AUTOCOMPLETE_LOOKUP', 'icontains')
+AUTOCOMPLETE_LIMIT = getattr(settings, 'POSITION_AUTOCOMPLETE_LIMIT', 20)
+AUTOCOMPLETE_CACHE_TIMEOUT = getattr(settings, 'POSITION_AUTOCOMPLETE_CACHE_TIMEOUT', 30)
+
+# The number of position content edited per page in order_content
+ORDER_PAGE_SIZE = getattr(settings, 'POSITION_ORDER_PAGE_SIZE', 100)
+
+# How the history entries buffered by PositionHistoryMiddleware are written
+# once the request commits: "queue" writes them from a thread of the process,
+# "sync" in the calling thread, or the dotted path to a callable that takes
+# the list of unsaved LogEntry instances. Entries logged outside the
+# middleware are always written right away.
+HISTORY_BACKEND = getattr(settings, 'POSITION_HISTORY_BACKEND', 'queue')
+
 # List of templates per model
 # EX: {"stories.story": "customtemplates/stories/position_render.html"}
 # TEMPLATES = getattr(settings, "POSITION_TEMPLATES", {})
\ No newline at end of file
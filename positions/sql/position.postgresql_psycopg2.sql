@@ -0,0 +1,2 @@
+-- Supports the case insensitive prefix matches of the json_data autocomplete.
+CREATE INDEX "positions_position_name_upper_like" ON "positions_position" (UPPER("name"::text) text_pattern_ops);
@@ -0,0 +1,6 @@
+-- Supports the ordered reads of a position in get_content, reorder and prune.
+CREATE INDEX "positions_positioncontent_position_order" ON "positions_positioncontent" ("position_id", "order");
+-- Supports the lookups of an object in contains_object, positions_for_object and get_applicable.
+CREATE INDEX "positions_positioncontent_object" ON "positions_positioncontent" ("content_type_id", "object_id", "position_id");
+-- Rejects objects added to a position twice, also when they are added at the same time.
+CREATE UNIQUE INDEX "positions_positioncontent_unique" ON "positions_positioncontent" ("position_id", "content_type_id", "object_id");
@@ -6,6 +6,7 @@ from django.contrib.contenttypes.models import ContentType
 
 from positions.models import Position, PositionContent
 from positions import settings as position_settings
+from positions.instrumentation import track_tag
 
 register = Library()
 
@@ -42,6 +43,7 @@ class PositionContentNode(Node):
         if str(kwargs.get('as_contenttype', 'True')).lower() == 'false':
             self.as_contenttype = False
     
+    @track_tag("get_position_content")
     def render(self, context):
         pos = resolve_variable(self.position, context)
         context[self.varname] = Position.objects.get_content(
@@ -51,11 +53,33 @@ class PositionContentNode(Node):
         return ""
     
 
+class PositionContentManyNode(Node):
+    def __init__(self, positions, **kwargs):
+        self.positions = positions
+        self.limit = int(kwargs.get('limit', '0'))
+        self.as_contenttype = True
+        if str(kwargs.get('as_contenttype', 'True')).lower() == 'false':
+            self.as_contenttype = False
+
+    @track_tag("get_position_content_many")
+    def render(self, context):
+        positions = [(resolve_variable(position, context), varname)
+            for position, varname in self.positions]
+        contents = Position.objects.get_content_many(
+            positions=[pos for pos, varname in positions],
+            count=self.limit,
+            as_contenttype=self.as_contenttype)
+        for pos, varname in positions:
+            context[varname] = contents[pos]
+        return ""
+
+
 class ApplicablePositionsNode(Node):
     def __init__(self, obj=None, content_type_id=None, object_id=None, varname=None, return_all=False):
         (self.obj, self.varname, self.return_all) = (obj, varname, return_all)
         (self.content_type_id, self.object_id) = (content_type_id, object_id)
     
+    @track_tag("get_applicable_positions")
     def render(self, context):
                 
         obj = resolve_variable(self.obj, context, none_on_fail=True)
@@ -79,6 +103,7 @@ class ContentPositionsNode(Node):
         (self.obj, self.varname) = (obj, varname)
         (self.content_type_id, self.object_id) = (content_type_id, object_id)
     
+    @track_tag("get_content_positions")
     def render(self, context):
         
         obj = resolve_variable(self.obj, context, none_on_fail=True)
@@ -106,6 +131,7 @@ class PositionNode(Node):
         if str(kwargs.get('slugify', 'True')).lower() == 'true':
             self.slugify = True
         
+    @track_tag("get_position")
     def render(self, context):
         
         name = resolve_variable(self.name, context)
@@ -120,12 +146,7 @@ class PositionNode(Node):
         if prefix:
             s_name = '%s%s%s' % (prefix, position_settings.CONBINE_STRING, name)
         
-        context[self.varname] = None
-        try:
-            position = Position.objects.get(name__iexact=s_name)
-            context[self.varname] = position
-        except Position.DoesNotExist:
-            pass
+        context[self.varname] = Position.objects.get_by_name(s_name)
                         
         return ""
         
@@ -136,6 +157,7 @@ class RenderPositionContentNode(Node):
         self.template = template
         self.suffix = suffix
         
+    @track_tag("render_position_content")
     def render(self, context):
         suffix, template = self.suffix, self.template
         
@@ -154,6 +176,7 @@ class CanBePositionedNode(Node):
         self.obj, self.content_type_id = obj, content_type_id
         self.object_id, self.varname = object_id, varname
         
+    @track_tag("can_be_positioned")
     def render(self, context):
         
         obj = resolve_variable(self.obj, context, none_on_fail=True)
@@ -200,6 +223,34 @@ def do_get_position_content(parser, token):
     
     return PositionContentNode(position, varname, **kwargs)
 
+def do_get_position_content_many(parser, token):
+    """
+    {% get_position_content_many position as content [position as content ...] %}
+    {% get_position_content_many position as content [position as content ...] [limit=N] [as_contenttype=True|False] %}
+
+    Retrieves the content of all the positions at once. Each position is
+    either a Position instance (e.g. position), or Position name
+    (e.g. home__headlines).
+    """
+    argv = token.contents.split()
+
+    positions, kwargs = [], {}
+    bits = argv[1:]
+    while bits and len(bits[0].split('=')) != 2:
+        if len(bits) < 3 or bits[1] != 'as':
+            raise TemplateSyntaxError, "Tag %s takes one or more 'position as varname' arguments." % argv[0]
+        positions.append((bits[0], bits[2]))
+        bits = bits[3:]
+
+    if not positions:
+        raise TemplateSyntaxError, "Tag %s takes at least 3 arguments." % argv[0]
+
+    for argument in bits:
+        if len(argument.split('=')) == 2:
+            kwargs[str(argument.split('=')[0])] = argument.split('=')[1]
+
+    return PositionContentManyNode(positions, **kwargs)
+
 def do_get_applicable_positions(parser, token):
     """
     {% get_applicable_positions object as positions [all] %}
@@ -337,6 +388,7 @@ def do_can_be_positioned(parser, token):
         return CanBePositionedNode(content_type_id=argv[1], object_id=argv[2], varname=argv[4])
         
 register.tag("get_position_content", do_get_position_content)
+register.tag("get_position_content_many", do_get_position_content_many)
 register.tag("get_content_positions", do_get_content_positions)
 register.tag("get_applicable_positions", do_get_applicable_positions)
 register.tag("get_position", do_get_position)
@@ -1,10 +1,33 @@
-from django.test import TestCase
-from django.db import models
+import datetime
+import shutil
+import tempfile
+
+from django.test import TestCase, TransactionTestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import get_cache
+from django.db import models, connection, transaction, IntegrityError
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.template import Template, Context, TemplateSyntaxError
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.contrib.admin.models import LogEntry, CHANGE
+from django.contrib import admin
+from django.test.client import RequestFactory
 
-from positions.models import Position, PositionContent
+from positions.models import Position, PositionContent, clear_template_cache
+from positions import models as position_models
 from positions import settings
+from positions.caching import get_content_version, get_content, get_version
+from positions import caching, instrumentation, history
+from positions.middleware import PositionHistoryMiddleware
+from positions.management.commands.warm_positions import Command as WarmPositions
+from positions.admin import PositionAdmin, PositionContentAdmin, PositionContentInline
+try:
+    from django.utils import simplejson
+except ImportError:
+    import json as simplejson
 
 class SimpleText(models.Model):
     """A Testing app"""
@@ -21,12 +44,31 @@ class SimpleCategory(models.Model):
     name = models.CharField(max_length=255)
 
 
+class SimpleNote(SimpleText):
+    """A Testing app inheriting from another"""
+    note = models.CharField(blank=True, max_length=255)
+
+
+def simple_text_version(obj):
+    return obj.firstname
+
+
+collected_history = []
+
+def collect_history(entries):
+    collected_history.extend(entries)
+
+
 def render(src, ctx={}):
     return Template(src).render(Context(ctx))
 
 class PositionsTestCase(TestCase):
     fixtures = ['test_data.json']
+    urls = 'positions.urls'
     def setUp(self):
+        # Tests that enable the cache should not see what others cached.
+        caching.cache.clear()
+
         self.text1 = SimpleText.objects.get(pk=1)
         self.text2 = SimpleText.objects.get(pk=2)
         self.text3 = SimpleText.objects.get(pk=3)
@@ -61,7 +103,59 @@ class PositionsTestCase(TestCase):
         """        
         self.assertTrue(Position.objects.add_object(self.samplePosition, self.text1))
         self.assertFalse(Position.objects.add_object(self.samplePosition, self.text1))
+
+        duplicate = PositionContent(position=self.samplePosition,
+            content_type=ContentType.objects.get_for_model(self.text1),
+            object_id=self.text1.pk, order=2)
+        self.assertRaises(ValidationError, duplicate.validate_unique)
+        self.assertRaises(IntegrityError, duplicate.save)
             
+    def testConcurrentAdd(self):
+        """
+        This test will ensure that adding objects relies on the unique
+        constraint instead of a query beforehand, that objects added by
+        others at the same time are skipped, and that content with the same
+        order is returned newest first.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+        version = get_version(self.samplePosition.pk)
+        # The eligibility of the object, the rejected insert and the check
+        # that the object is there
+        with self.assertNumQueries(3):
+            self.assertFalse(Position.objects.add_object(self.samplePosition, self.text1))
+        self.assertEqual(get_version(self.samplePosition.pk), version)
+
+        # Integrity errors other than the unique constraint are raised
+        def failing_create(**kwargs):
+            raise IntegrityError('foreign key constraint failed')
+        PositionContent._default_manager.create = failing_create
+        try:
+            self.assertRaises(IntegrityError, Position.objects.add_object,
+                self.samplePosition, self.text2)
+        finally:
+            del PositionContent._default_manager.create
+
+        # Another editor adds text3 after the current content was read
+        insert_objects = Position.objects._insert_objects
+        def racing_insert(*args):
+            Position.objects._insert_objects = insert_objects
+            PositionContent.objects.create(position=self.samplePosition,
+                content_type=ContentType.objects.get_for_model(self.text3),
+                object_id=self.text3.pk, order=1)
+            raise IntegrityError('columns position_id, content_type_id, object_id are not unique')
+        Position.objects._insert_objects = racing_insert
+        try:
+            added = Position.objects.add_objects(self.samplePosition, [self.text2, self.text3])
+        finally:
+            Position.objects._insert_objects = insert_objects
+        self.assertEqual(added, [self.text2])
+
+        PositionContent.objects.create(position=self.samplePosition,
+            content_type=ContentType.objects.get_for_model(self.text4),
+            object_id=self.text4.pk, order=1)
+        self.assertEqual(Position.objects.get_content(self.samplePosition),
+            [self.text4, self.text2, self.text3])
+
     def testObjectOrder(self):
         """
         This test will ensure that the objects will properly adjust its order 
@@ -84,6 +178,45 @@ class PositionsTestCase(TestCase):
         self.assertEqual(pc[0].content_object, self.text2)
         self.assertEqual(pc[1].order, 2)
         
+    def testAddObjects(self):
+        """
+        This test will ensure that several objects can be added at once, in
+        the order they are supplied, skipping the objects that are not
+        allowed or already in the position.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+
+        added = Position.objects.add_objects(self.samplePosition,
+            [self.text2, self.cat1, self.text1, self.text3, self.text2])
+        self.assertEqual(added, [self.text2, self.text3])
+
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)
+        self.assertEqual([(i.content_object, i.order) for i in pc],
+            [(self.text2, 1), (self.text3, 2), (self.text1, 3)])
+
+        # The position is pruned once all the objects are added
+        Position.objects.add_objects(self.samplePosition,
+            [self.text4, self.text5, self.text6], order=2)
+        pc = PositionContent.objects.filter(position=self.samplePosition)
+        self.assertEqual([i.content_object for i in pc],
+            [self.text2, self.text4, self.text5, self.text6, self.text3])
+
+    def testRemoveObjects(self):
+        """
+        This test will ensure that several objects can be removed at once and
+        the order of the remaining objects is adjusted.
+        """
+        Position.objects.add_objects(self.samplePosition,
+            [self.text1, self.text2, self.text3, self.text4])
+
+        removed = Position.objects.remove_objects(self.samplePosition,
+            [self.text3, self.text1, self.text5])
+        self.assertEqual(removed, [self.text1, self.text3])
+
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)
+        self.assertEqual([(i.content_object, i.order) for i in pc],
+            [(self.text2, 1), (self.text4, 2)])
+
     def testRemove(self):
         """
         This test will ensure that removal of objects from a position will 
@@ -136,7 +269,39 @@ class PositionsTestCase(TestCase):
         
         self.assertEqual(len(pc), 5)
         self.assertNotEqual(pc[4], self.text1)
+
+    def testPruneScheduledContent(self):
+        """
+        This test will ensure that content scheduled to start later is not
+        pruned, nor counted toward the position.count + CONTENT_OVERLAP_COUNT.
+        """
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        for text in (self.text1, self.text2, self.text3, self.text4, self.text5):
+            Position.objects.add_object(self.samplePosition, text, start_date=tomorrow)
+        Position.objects.add_object(self.samplePosition, self.text6)
+
+        pc = PositionContent.objects.filter(position=self.samplePosition)
+        self.assertEqual(len(pc), 6)
+        self.assertEqual(Position.objects.get_content(self.samplePosition), [self.text6])
         
+    def testSetOrder(self):
+        """
+        This test will ensure that set_order applies a new order and removes
+        items from a position.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+        Position.objects.add_object(self.samplePosition, self.text2)
+        Position.objects.add_object(self.samplePosition, self.text3)
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)
+
+        with self.assertNumQueries(3):
+            PositionContent.objects.set_order(self.samplePosition,
+                {pc[0].pk: 2, pc[2].pk: 1}, removed=[pc[1].pk])
+
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)
+        self.assertEqual([(i.content_object, i.order) for i in pc],
+            [(self.text1, 1), (self.text3, 2)])
+
     def testGetContent(self):
         """
         This test will ensure that get_content manager method returns the 
@@ -177,6 +342,449 @@ class PositionsTestCase(TestCase):
         for item in pc5:
             self.assertTrue(isinstance(item, PositionContent))
         
+    def testGetContentCache(self):
+        """
+        This test will ensure that get_content caches the position contents
+        and that any change to the position is visible right away.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_object(self.samplePosition, self.text2)
+
+            # Warm up the cache, after which only the content objects are
+            # queried.
+            Position.objects.get_content('sample_position', as_contenttype=False)
+            with self.assertNumQueries(1):
+                pc = Position.objects.get_content('sample_position',
+                    as_contenttype=False)
+            with self.assertNumQueries(0):
+                self.assertEqual([i.content_object for i in pc], [self.text2, self.text1])
+                self.assertEqual(pc[0].position.count, 3)
+
+            # Adding, removing and re-ordering should all invalidate the cache
+            Position.objects.add_object(self.samplePosition, self.text3)
+            self.assertEqual(Position.objects.get_content('sample_position'),
+                [self.text3, self.text2, self.text1])
+
+            Position.objects.remove_object(self.samplePosition, self.text2)
+            self.assertEqual(Position.objects.get_content(self.samplePosition),
+                [self.text3, self.text1])
+
+            item = PositionContent.objects.get(position=self.samplePosition,
+                object_id=self.text1.pk)
+            item.order = 0
+            item.save()
+            self.assertEqual(Position.objects.get_content(self.samplePosition),
+                [self.text1, self.text3])
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+    def testGetContentMany(self):
+        """
+        This test will ensure that get_content_many returns the content of
+        several positions, keyed by the supplied position name or instance.
+        """
+        otherPosition = Position.objects.create(name="other_position",
+            count=2, allow_all_types=True)
+        Position.objects.add_object(self.samplePosition, self.text1)
+        Position.objects.add_object(self.samplePosition, self.text2)
+        Position.objects.add_object(otherPosition, self.cat1)
+        Position.objects.add_object(otherPosition, self.text1)
+
+        contents = Position.objects.get_content_many(
+            ['sample_position', otherPosition, 'missing_position'])
+        self.assertEqual(contents, {
+            'sample_position': [self.text2, self.text1],
+            otherPosition: [self.text1, self.cat1],
+            'missing_position': []})
+
+        contents = Position.objects.get_content_many(
+            [self.samplePosition, otherPosition], count=1, as_contenttype=False)
+        self.assertEqual(contents[self.samplePosition][0].content_object, self.text2)
+        self.assertEqual(contents[otherPosition][0].content_object, self.text1)
+
+    def testGetContentMissingObjects(self):
+        """
+        This test will ensure that get_content skips the contents whose
+        content object was deleted, using a single query per content type.
+        """
+        otherPosition = Position.objects.create(name="other_position",
+            count=5, allow_all_types=True)
+        Position.objects.add_object(otherPosition, self.text1)
+        Position.objects.add_object(otherPosition, self.cat1)
+        Position.objects.add_object(otherPosition, self.text2)
+        Position.objects.add_object(otherPosition, self.cat2)
+        SimpleText.objects.filter(pk=self.text2.pk).delete()
+
+        # One query for the position content and one per content type
+        with self.assertNumQueries(3):
+            self.assertEqual(Position.objects.get_content(otherPosition),
+                [self.cat2, self.cat1, self.text1])
+
+        with self.assertNumQueries(3):
+            pc = Position.objects.get_content(otherPosition, as_contenttype=False)
+        with self.assertNumQueries(0):
+            self.assertEqual([i.content_object for i in pc],
+                [self.cat2, self.cat1, self.text1])
+
+    def testObjectPk(self):
+        """
+        This test will ensure that the integer object_pk is filled and that
+        the content of a position can be joined to a queryset through it.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+        Position.objects.add_objects(self.samplePosition, [self.text2, self.text3])
+        pc = PositionContent.objects.filter(position=self.samplePosition)
+        self.assertEqual([i.object_pk for i in pc], [2, 3, 1])
+
+        with self.assertNumQueries(1):
+            pc = list(PositionContent.objects.matching(self.samplePosition,
+                SimpleText.objects.exclude(firstname='Bobby')))
+        self.assertEqual([i.object_pk for i in pc], [3, 1])
+
+        PositionContent.objects.update(object_pk=None)
+        call_command('positions_fill_object_pk', verbosity=0)
+        pc = PositionContent.objects.filter(position=self.samplePosition)
+        self.assertEqual([i.object_pk for i in pc], [2, 3, 1])
+
+    def testScheduledContent(self):
+        """
+        This test will ensure that only the content scheduled to be shown now
+        is returned and that it is cached until the next start or end date.
+        """
+        now = datetime.datetime.now()
+        hour = datetime.timedelta(hours=1)
+        Position.objects.add_object(self.samplePosition, self.text1)
+        Position.objects.add_object(self.samplePosition, self.text2, end_date=now - hour)
+        Position.objects.add_object(self.samplePosition, self.text3, start_date=now + hour)
+        Position.objects.add_object(self.samplePosition, self.text4,
+            start_date=now - hour, end_date=now + 2 * hour)
+        self.assertEqual(Position.objects.get_content(self.samplePosition),
+            [self.text4, self.text1])
+
+        items = PositionContent.objects.filter(position=self.samplePosition)
+        live, boundary = position_models._live_items(items, now)
+        self.assertEqual([i.content_object for i in live], [self.text4, self.text1])
+        self.assertEqual(boundary, now + hour)
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            self.assertEqual(position_models._cache_timeout(boundary, now), 60 * 60)
+            self.assertEqual(position_models._cache_timeout(now + hour / 6, now), 10 * 60)
+            self.assertEqual(position_models._cache_timeout(None, now), 60 * 60)
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+        self.assertEqual(position_models._live_items(items, now + 3 * hour)[0][0].content_object,
+            self.text3)
+
+    def testSnapshot(self):
+        """
+        This test will ensure that the snapshot of a position is rewritten
+        when its content changes and that the content is read from it.
+        """
+        snapshots, cache_timeout = settings.SNAPSHOTS, settings.CACHE_TIMEOUT
+        settings.SNAPSHOTS, settings.CACHE_TIMEOUT = True, 0
+        try:
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_objects(self.samplePosition, [self.text2, self.text3])
+            Position.objects.remove_object(self.samplePosition, self.text3)
+            position = Position.objects.get(pk=self.samplePosition.pk)
+            self.assertEqual([i[2] for i in simplejson.loads(position.snapshot)], ['2', '1'])
+
+            with self.assertNumQueries(2):
+                content = Position.objects.get_content(self.samplePosition,
+                    as_contenttype=False)
+            self.assertEqual([c.content_object for c in content], [self.text2, self.text1])
+            self.assertEqual([c.order for c in content], [1, 2])
+
+            # The content is read from the snapshot alone
+            Position.objects.filter(pk=self.samplePosition.pk).update(snapshot='[]')
+            self.assertEqual(Position.objects.get_content(self.samplePosition), [])
+            Position.objects.refresh_snapshot(self.samplePosition.pk)
+
+            # Content saved outside the managers is picked up as well
+            content[1].order = 0
+            content[1].save()
+            self.assertEqual(Position.objects.get_content(self.samplePosition),
+                [self.text1, self.text2])
+
+            PositionContent.objects.filter(position=self.samplePosition).delete()
+            self.assertEqual(Position.objects.get_content(self.samplePosition), [])
+        finally:
+            settings.SNAPSHOTS, settings.CACHE_TIMEOUT = snapshots, cache_timeout
+
+        call_command('positions_refresh_snapshots', verbosity=0)
+        self.assertEqual(Position.objects.get(pk=self.samplePosition.pk).snapshot, '')
+
+    def testContentJson(self):
+        """
+        This test will ensure that the content of positions is returned as
+        JSON and that repeated requests get a 304 without queries.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_object(self.samplePosition, self.text2)
+            url = reverse('positions_content', args=['sample_position,missing_position'])
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = simplejson.loads(response.content)
+            self.assertEqual(data['missing_position'], [])
+            self.assertEqual([(i['object_id'], i['order'], i['object']['name'])
+                for i in data['sample_position']], [('2', 1, 'Bobby'), ('1', 2, 'Joe')])
+            self.assertEqual(data['sample_position'][0]['content_type'], 'positions.simpletext')
+            etag = response['ETag']
+
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url, {'limit': 1}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(len(simplejson.loads(response.content)['sample_position']), 1)
+
+            Position.objects.add_object(self.samplePosition, self.text3)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+            serializers = settings.SERIALIZERS
+            settings.SERIALIZERS = {'positions.simpletext': 'positions.tests.simple_text_version'}
+            try:
+                response = self.client.get(url)
+                self.assertEqual(simplejson.loads(response.content)['sample_position'][0]['object'],
+                    'Jenny')
+            finally:
+                settings.SERIALIZERS = serializers
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+    def testJsonData(self):
+        """
+        This test will ensure that the autocomplete matches the term in SQL,
+        limits the results and caches them.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            for name in ('sample_other', 'other_sample', 'unrelated'):
+                Position.objects.create(name=name, allow_all_types=True)
+            ctype = ContentType.objects.get_for_model(self.text1)
+            url = reverse('positions_jsondata', args=[ctype.pk, self.text1.pk])
+
+            response = self.client.get(url, {'term': 'Sample'})
+            self.assertEqual([p['name'] for p in simplejson.loads(response.content)],
+                ['other_sample', 'sample_other', 'sample_position'])
+            with self.assertNumQueries(0):
+                self.client.get(url, {'term': 'Sample'})
+
+            lookup, limit = settings.AUTOCOMPLETE_LOOKUP, settings.AUTOCOMPLETE_LIMIT
+            settings.AUTOCOMPLETE_LOOKUP, settings.AUTOCOMPLETE_LIMIT = 'istartswith', 1
+            try:
+                response = self.client.get(url, {'term': 'samp'})
+                self.assertEqual([p['name'] for p in simplejson.loads(response.content)],
+                    ['sample_other'])
+            finally:
+                settings.AUTOCOMPLETE_LOOKUP, settings.AUTOCOMPLETE_LIMIT = lookup, limit
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+    def testOrderContentBulk(self):
+        """
+        This test will ensure that the bulk ordering view applies a new
+        order and removes content with a single history entry.
+        """
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        Position.objects.add_objects(self.samplePosition, [self.text1, self.text2, self.text3])
+        pc = list(PositionContent.objects.filter(position=self.samplePosition))
+        url = reverse('positions_order_bulk', args=[self.samplePosition.pk])
+
+        update_history, backend = settings.UPDATE_POSITION_HISTORY, settings.HISTORY_BACKEND
+        settings.UPDATE_POSITION_HISTORY, settings.HISTORY_BACKEND = True, 'sync'
+        try:
+            response = self.client.post(url, {'order': '%s,%s' % (pc[2].pk, pc[0].pk),
+                'remove': str(pc[1].pk)})
+        finally:
+            settings.UPDATE_POSITION_HISTORY, settings.HISTORY_BACKEND = update_history, backend
+        self.assertEqual(simplejson.loads(response.content), {'ordered': 2, 'removed': 1})
+        self.assertEqual(Position.objects.get_content(self.samplePosition), [self.text3, self.text1])
+        self.assertEqual(LogEntry.objects.count(), 1)
+
+        # Content left out of the order keeps its current order after it
+        Position.objects.add_objects(self.samplePosition, [self.text2, self.text4])
+        pc = list(PositionContent.objects.filter(position=self.samplePosition))
+        response = self.client.post(url, {'order': '%s,%s' % (pc[3].pk, pc[1].pk)})
+        self.assertEqual(list(PositionContent.objects.filter(
+            position=self.samplePosition).values_list('pk', 'order')),
+            [(pc[3].pk, 1), (pc[1].pk, 2), (pc[0].pk, 3), (pc[2].pk, 4)])
+
+        response = self.client.post(url, {'order': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def testAdminChangelist(self):
+        """
+        This test will ensure that the current items and eligible types of
+        the positions on the admin changelist take a fixed number of queries.
+        """
+        otherPosition = Position.objects.create(name="other_position", count=1,
+            allow_all_types=True)
+        Position.objects.add_objects(self.samplePosition, [self.text1, self.text2, self.text3])
+        Position.objects.add_objects(otherPosition, [self.text4, self.cat1])
+        position_admin = PositionAdmin(Position, admin.site)
+
+        # The positions, the eligible types, the ids and the first items and
+        # one query per content type.
+        with self.assertNumQueries(6):
+            positions = list(position_admin.queryset(None))
+            position_admin.prefetch_current_items(positions)
+            rows = [(position_admin.current_items(p), position_admin.list_eligible_types(p))
+                for p in positions]
+        self.assertEqual(rows[0][0], u'<ul><li>Chris</li><hr style="background-color:#a2a2a2;"/><li>SimpleCategory object</li></ul>')
+        self.assertEqual(rows[1][0], u'<ul><li>Joe</li><li>Bobby</li><li>Jenny</li><hr style="background-color:#a2a2a2;"/></ul>')
+        self.assertEqual(rows[1][1], u'<ul><li>positions.simpletext</li></ul>')
+
+        position_admin.list_items = 1
+        self.assertTrue(position_admin.current_items(positions[1]).endswith(u'and 2 more</ul>'))
+
+    def testAdminContentObjects(self):
+        """
+        This test will ensure that the inline and the changelist of position
+        content load the content objects per content type.
+        """
+        Position.objects.add_objects(self.samplePosition, [self.text1, self.text2, self.text3])
+        allPosition = Position.objects.create(name="all_position", allow_all_types=True)
+        Position.objects.add_objects(allPosition, [self.cat1, self.cat2])
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+        for model_admin in (PositionContentInline(Position, admin.site),
+            PositionContentAdmin(PositionContent, admin.site)):
+            with self.assertNumQueries(3):
+                rows = [(unicode(pc), unicode(pc.content_object))
+                    for pc in model_admin.queryset(request)]
+            self.assertEqual(len(rows), 5)
+
+    def testHistory(self):
+        """
+        This test will ensure that history entries logged during a request
+        are buffered and written at once by the configured backend.
+        """
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        ctype = ContentType.objects.get_for_model(Position)
+        middleware = PositionHistoryMiddleware()
+
+        backend = settings.HISTORY_BACKEND
+        settings.HISTORY_BACKEND = 'sync'
+        try:
+            middleware.process_request(None)
+            history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'One')
+            history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'Two')
+            self.assertEqual(LogEntry.objects.count(), 0)
+            with self.assertNumQueries(1):
+                middleware.process_response(None, None)
+            self.assertEqual(sorted(LogEntry.objects.values_list('change_message', flat=True)),
+                [u'One', u'Two'])
+
+            middleware.process_request(None)
+            history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'Three')
+            middleware.process_exception(None, None)
+            middleware.process_response(None, None)
+            self.assertEqual(LogEntry.objects.count(), 2)
+
+            settings.HISTORY_BACKEND = 'positions.tests.collect_history'
+            middleware.process_request(None)
+            history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'Four')
+            middleware.process_response(None, None)
+            self.assertEqual([e.change_message for e in collected_history], ['Four'])
+
+            # Outside a request entries are written right away, whatever the
+            # backend
+            history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'Five')
+            self.assertEqual(LogEntry.objects.count(), 3)
+            self.assertEqual(len(collected_history), 1)
+
+            # The queue is written to from another thread
+            written, save = [], history.save
+            history.save = written.extend
+            settings.HISTORY_BACKEND = 'queue'
+            try:
+                middleware.process_request(None)
+                history.log(user.pk, ctype.pk, self.samplePosition.pk, 'sample_position', CHANGE, 'Six')
+                middleware.process_response(None, None)
+                history.wait()
+            finally:
+                history.save = save
+            self.assertEqual([e.change_message for e in written], ['Six'])
+        finally:
+            settings.HISTORY_BACKEND = backend
+
+    def testOrphans(self):
+        """
+        This test will ensure that deleted objects are removed from positions
+        and that orphans left by deletes without signals are swept.
+        """
+        position_models._placed_types.clear()
+        Position.objects.add_objects(self.samplePosition, [self.text1, self.text2, self.text3])
+        self.text2.delete()
+        self.assertEqual(PositionContent.objects.filter(position=self.samplePosition).count(), 2)
+        self.assertEqual(Position.objects.get_content(self.samplePosition), [self.text1, self.text3])
+
+        # Objects of types not in any position are left alone, also when
+        # positions allow them and the cache is disabled
+        Position.objects.create(name="all_types", count=3, allow_all_types=True)
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 0
+        try:
+            with self.assertNumQueries(1):
+                self.cat1.delete()
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+        PositionContent.objects.filter(object_id=self.text3.pk).update(object_id='999', object_pk=999)
+        call_command('positions_sweep_orphans', dry_run=True, verbosity=0)
+        self.assertEqual(PositionContent.objects.count(), 2)
+        call_command('positions_sweep_orphans', batch_size=1, verbosity=0)
+        self.assertEqual(list(PositionContent.objects.values_list('object_id', flat=True)), ['1'])
+
+        # The primary key of a child model is a one to one field
+        note = SimpleNote.objects.create(firstname='Note')
+        for object_id in (note.pk, 999):
+            PositionContent.objects.create(position=self.samplePosition,
+                content_type=ContentType.objects.get_for_model(SimpleNote),
+                object_id=object_id, order=1)
+        call_command('positions_sweep_orphans', verbosity=0)
+        self.assertEqual(list(PositionContent.objects.order_by('pk').values_list(
+            'object_id', flat=True)), ['1', unicode(note.pk)])
+
+    def testWarmPositions(self):
+        """
+        This test will ensure that warm_positions caches the content of
+        positions.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            Position.objects.add_objects(self.samplePosition, [self.text1, self.text2])
+
+            # The local memory cache of this process is not shared
+            self.assertRaises(CommandError, WarmPositions().handle, workers=0)
+
+            cache_dir = tempfile.mkdtemp()
+            local_cache, caching.cache = caching.cache, get_cache(
+                'django.core.cache.backends.filebased.FileBasedCache',
+                LOCATION=cache_dir)
+            try:
+                version = get_version(self.samplePosition.pk)
+                self.assertEqual(get_content(self.samplePosition.pk, version), None)
+                call_command('warm_positions', 'sample_position', workers=0, verbosity=0)
+                self.assertEqual(len(get_content(self.samplePosition.pk, version)[1]), 2)
+            finally:
+                caching.cache = local_cache
+                shutil.rmtree(cache_dir)
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
     def testContainsObject(self):
         """
         This test will ensure that contains_object works correctly
@@ -234,6 +842,74 @@ class PositionsTestCase(TestCase):
         self.assertEqual(len(positions), 1)
         self.assertEqual(positions[0], self.samplePosition)
         
+    def testEligibilityIndex(self):
+        """
+        This test will ensure that is_applicable, can_be_positioned and
+        get_applicable answer from the eligibility index, which is rebuilt
+        when the eligible types of a position change.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            Position.objects.can_be_positioned(self.text1)
+            with self.assertNumQueries(0):
+                self.assertTrue(Position.objects.is_applicable(self.samplePosition, self.text1))
+                self.assertFalse(Position.objects.is_applicable(self.samplePosition, self.cat1))
+                self.assertTrue(Position.objects.can_be_positioned(self.text1))
+                self.assertFalse(Position.objects.can_be_positioned(self.cat1))
+                self.assertEqual(list(Position.objects.get_applicable(self.cat1)), [])
+
+            self.samplePosition.eligible_types.add(ContentType.objects.get_for_model(SimpleCategory))
+            self.assertTrue(Position.objects.is_applicable(self.samplePosition, self.cat1))
+            self.assertEqual(list(Position.objects.get_applicable(self.cat1)), [self.samplePosition])
+
+            self.samplePosition.eligible_types.clear()
+            self.assertFalse(Position.objects.can_be_positioned(self.text1))
+
+            allPosition = Position.objects.create(name="all_position", allow_all_types=True)
+            self.assertTrue(Position.objects.can_be_positioned(self.text1))
+            self.assertEqual(list(Position.objects.get_applicable(self.cat1)), [allPosition])
+
+            allPosition.delete()
+            self.assertFalse(Position.objects.can_be_positioned(self.cat1))
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+    def testGetByName(self):
+        """
+        This test will ensure that positions are resolved by name case
+        insensitive, without queries once resolved, and that changes to the
+        position are picked up.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            self.assertEqual(Position.objects.get_by_name('sample_position'), self.samplePosition)
+            self.assertEqual(Position.objects.get_by_name('missing_position'), None)
+            with self.assertNumQueries(0):
+                self.assertEqual(Position.objects.get_by_name('sample_position'), self.samplePosition)
+                self.assertEqual(Position.objects.get_by_name('missing_position'), None)
+
+            self.assertEqual(Position.objects.get_by_name('Sample_Position'), self.samplePosition)
+            self.assertEqual(Position.objects.get_by_name('missing_position'), None)
+
+            self.samplePosition.count = 5
+            self.samplePosition.save()
+            self.assertEqual(Position.objects.get_by_name('sample_position').count, 5)
+
+            self.samplePosition.name = 'renamed_position'
+            self.samplePosition.save()
+            self.assertEqual(Position.objects.get_by_name('sample_position'), None)
+            self.assertEqual(Position.objects.get_by_name('renamed_position'), self.samplePosition)
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+        # Without the cache every name is looked up with a single query
+        with self.assertNumQueries(1):
+            self.assertEqual(Position.objects.get_by_name('Renamed_Position'), self.samplePosition)
+        with self.assertNumQueries(1):
+            self.assertEqual(Position.objects.get_by_name('missing_position'), None)
+        Position.objects.create(name='Renamed_Position', count=1)
+        self.assertEqual(Position.objects.get_by_name('renamed_position'), self.samplePosition)
+
     def testTTGetPosition(self):
         """
         {% get_position [name] as [varname] %}
@@ -293,6 +969,25 @@ class PositionsTestCase(TestCase):
         t = "{% load position_tags %}{% get_position_content position as content as_contenttype=False %}{% for c in content %}{{ c.content_object }},{% endfor %}"
         self.assertEqual(render(t, {'position': self.samplePosition}), "Jenny,Bobby,Joe,")
         
+    def testTTGetPositionContentMany(self):
+        """
+        {% get_position_content_many position as content [position as content ...] [limit=N] [as_contenttype=True|False] %}
+        """
+        otherPosition = Position.objects.create(name="other_position",
+            count=2, allow_all_types=True)
+        Position.objects.add_object(self.samplePosition, self.text1)
+        Position.objects.add_object(self.samplePosition, self.text2)
+        Position.objects.add_object(otherPosition, self.text3)
+
+        t = "{% load position_tags %}{% get_position_content_many position as content 'other_position' as other %}{% for c in content %}{{ c }},{% endfor %}{% for c in other %}{{ c }},{% endfor %}"
+        self.assertEqual(render(t, {'position': self.samplePosition}), "Bobby,Joe,Jenny,")
+
+        t = "{% load position_tags %}{% get_position_content_many position as content 'other_position' as other limit=1 as_contenttype=False %}{% for c in content %}{{ c.content_object }},{% endfor %}{% for c in other %}{{ c.content_object }},{% endfor %}"
+        self.assertEqual(render(t, {'position': self.samplePosition}), "Bobby,Jenny,")
+
+        t = "{% load position_tags %}{% get_position_content_many position %}"
+        self.assertRaises(TemplateSyntaxError, render, t)
+
     def testTTGetContentPositions(self):
         """
         {% get_content_positions object as positions %}
@@ -365,4 +1060,152 @@ class PositionsTestCase(TestCase):
         
         t = "{% load position_tags %}{% render_position_content pc with template=position_test/custom_template.html %}"
         self.assertEqual(render(t, {"pc": pc}), "<div>CUSTOM - 1 - Joe</div>")
-        
\ No newline at end of file
+
+    def testRenderTemplateCache(self):
+        """
+        This test will ensure that the template selected to render a
+        PositionContent is cached, unless TEMPLATE_DEBUG is on.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)[0]
+        clear_template_cache()
+
+        with self.settings(TEMPLATE_DEBUG=False):
+            self.assertEqual(pc.render(), "<div>1 - Joe</div>")
+            self.assertEqual(pc.render(template="position_test/custom_template.html"),
+                "<div>CUSTOM - 1 - Joe</div>")
+            self.assertEqual(len(position_models._template_cache), 2)
+
+            t = pc.get_template()
+            self.assertTrue(pc.get_template() is t)
+
+        with self.settings(TEMPLATE_DEBUG=True):
+            self.assertEqual(pc.render(), "<div>1 - Joe</div>")
+            self.assertEqual(len(position_models._template_cache), 0)
+
+    def testRenderCache(self):
+        """
+        This test will ensure that rendered PositionContent is cached until
+        the position or the version of the content object changes.
+        """
+        Position.objects.add_object(self.samplePosition, self.text1)
+        pc = Position.objects.get_content(self.samplePosition, as_contenttype=False)[0]
+
+        render_timeout, content_version, cache_timeout = (settings.RENDER_CACHE_TIMEOUT,
+            settings.CONTENT_VERSION, settings.CACHE_TIMEOUT)
+        settings.RENDER_CACHE_TIMEOUT = 60
+        settings.CONTENT_VERSION = lambda obj: obj.lastname
+        settings.CACHE_TIMEOUT = 60 * 60
+        try:
+            self.assertEqual(pc.render(), "<div>1 - Joe</div>")
+
+            # The content object changed, but its version did not.
+            pc.content_object.firstname = "Joseph"
+            self.assertEqual(pc.render(), "<div>1 - Joe</div>")
+
+            pc.content_object.lastname = "Smith"
+            self.assertEqual(pc.render(), "<div>1 - Joseph</div>")
+
+            # Changing the position renders the content again
+            pc.content_object.firstname = "Joe"
+            Position.objects.add_object(self.samplePosition, self.text2)
+            self.assertEqual(pc.render(), "<div>1 - Joe</div>")
+
+            # Without the position versions nothing is cached
+            settings.CACHE_TIMEOUT = 0
+            pc.content_object.firstname = "Joseph"
+            self.assertEqual(pc.render(), "<div>1 - Joseph</div>")
+        finally:
+            settings.RENDER_CACHE_TIMEOUT = render_timeout
+            settings.CONTENT_VERSION = content_version
+            settings.CACHE_TIMEOUT = cache_timeout
+
+        settings.CONTENT_VERSION = 'positions.tests.simple_text_version'
+        try:
+            self.assertEqual(get_content_version(self.text1), 'Joe')
+        finally:
+            settings.CONTENT_VERSION = content_version
+
+    def testInstrumentation(self):
+        """
+        This test will ensure that the work done by positions is recorded per
+        position and per template tag while statistics are collected.
+        """
+        cache_timeout, settings.CACHE_TIMEOUT = settings.CACHE_TIMEOUT, 60 * 60
+        try:
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_object(self.samplePosition, self.text2)
+            t = "{% load position_tags %}{% get_position_content position as content as_contenttype=False %}{% for c in content %}{% render_position_content c %}{% endfor %}"
+
+            render(t, {'position': self.samplePosition})
+            self.assertEqual(instrumentation.get_stats(), None)
+
+            instrumentation.start()
+            try:
+                render(t, {'position': self.samplePosition})
+                render(t, {'position': self.samplePosition})
+            finally:
+                stats = instrumentation.stop()
+            self.assertFalse(instrumentation.is_active())
+
+            position = stats['positions']['sample_position']
+            self.assertEqual(position['calls'], 2)
+            self.assertEqual(position['cache_hits'], 2)
+            self.assertEqual(position['renders'], 4)
+            self.assertEqual(position['template_lookups'], 4)
+            self.assertEqual(stats['tags']['get_position_content']['calls'], 2)
+            self.assertEqual(stats['tags']['render_position_content']['calls'], 4)
+            self.assertEqual(stats['tags']['render_position_content']['renders'], 4)
+            self.assertTrue(instrumentation.summary(stats).startswith('1 positions, 6 tags'))
+        finally:
+            settings.CACHE_TIMEOUT = cache_timeout
+
+
+class PositionsTransactionTestCase(TransactionTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.text1 = SimpleText.objects.get(pk=1)
+        self.text2 = SimpleText.objects.get(pk=2)
+        self.text3 = SimpleText.objects.get(pk=3)
+
+        self.samplePosition = Position.objects.create(name="sample_position", count=3)
+        self.samplePosition.eligible_types.add(ContentType.objects.get_for_model(SimpleText))
+
+    def testInvalidateAfterCommit(self):
+        """
+        This test will ensure that positions are invalidated after the
+        transaction their content was changed in commits, so readers cannot
+        cache the content read before the commit under the new version.
+        """
+        depths = []
+        bump_version = caching.bump_version
+        def recording_bump(position_id):
+            depths.append(len(connection.transaction_state))
+            bump_version(position_id)
+        caching.bump_version = recording_bump
+        try:
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_objects(self.samplePosition, [self.text2, self.text3])
+            Position.objects.remove_object(self.samplePosition, self.text2)
+            Position.objects.remove_objects(self.samplePosition, [self.text3])
+        finally:
+            caching.bump_version = bump_version
+        self.assertEqual(depths, [0] * 4)
+
+    def testJoinTransaction(self):
+        """
+        This test will ensure that changes made inside the transaction of the
+        caller are rolled back with it instead of committing it.
+        """
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            Position.objects.create(name="other_position", count=3)
+            Position.objects.add_object(self.samplePosition, self.text1)
+            Position.objects.add_objects(self.samplePosition, [self.text2])
+            transaction.rollback()
+        finally:
+            transaction.leave_transaction_management()
+        self.assertFalse(Position.objects.filter(name="other_position").exists())
+        self.assertEqual(PositionContent.objects.count(), 0)
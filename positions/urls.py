@@ -13,6 +13,18 @@ urlpatterns = patterns('positions.views',
         view="json_data",
         name="positions_jsondata"),
 
+    url(regex=r'^content/(?P<position_names>[\w_,-]+)/$',
+        view="content_json",
+        name="positions_content"),
+
+    url(regex=r'^order/(?P<position_id>[\d]+)/$',
+        view="order_content",
+        name="positions_order"),
+
+    url(regex=r'^order/(?P<position_id>[\d]+)/bulk/$',
+        view="order_content_bulk",
+        name="positions_order_bulk"),
+
     url(regex=r'^$',
         view='index',
         name='positions_index')
@@ -1,4 +1,10 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden, Http404
+from django.http import HttpResponseNotModified, HttpResponseBadRequest, HttpResponseNotAllowed
 from django.views.decorators.cache import cache_page, never_cache
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
@@ -6,10 +12,13 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 from django.utils.safestring import mark_safe
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.cache import cache
-from django.contrib.admin.models import ADDITION, DELETION, CHANGE, LogEntry
-from django.utils.encoding import force_unicode
+from django.contrib.admin.models import ADDITION, DELETION, CHANGE
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.http import parse_etags, quote_etag, http_date, parse_http_date_safe
+from django.utils.importlib import import_module
 try:
     from django.utils import simplejson
 except ImportError:
@@ -18,6 +27,7 @@ except ImportError:
 from positions.models import Position, PositionContent
 from positions.forms import PositionContentOrderForm
 from positions import settings as position_settings
+from positions import caching, history
 
 def get_admin_url(obj, fallback="/admin/positions/"):
     """
@@ -43,24 +53,154 @@ def json_data(request, content_type_id, object_id):
     """
     if not simplejson:
         raise Http404
-        
-    ctype = get_object_or_404(ContentType, pk=content_type_id)
+
+    term = request.GET.get('term', "")
     try:
-        obj = ctype.get_object_for_this_type(id=object_id)
-    except:
+        ctype = ContentType.objects.get_for_id(int(content_type_id))
+    except (ContentType.DoesNotExist, ValueError):
         raise Http404
-    
-    positions = Position.objects.get_applicable(obj)
-    
-    data = [{"id":pos.pk,"name":pos.name,"value":pos.name} for pos in positions if request.GET.get('term', "") in pos.name]
-    
+
+    data = caching.get_autocomplete(ctype.pk, object_id, term)
+    if data is None:
+        try:
+            obj = ctype.get_object_for_this_type(id=object_id)
+        except:
+            raise Http404
+
+        positions = Position.objects.get_applicable(obj)
+        if term:
+            positions = positions.filter(**{
+                'name__%s' % position_settings.AUTOCOMPLETE_LOOKUP: term})
+        positions = positions.order_by('name').values_list('pk', 'name')
+
+        data = [{"id": pk, "name": name, "value": name}
+            for pk, name in positions[:position_settings.AUTOCOMPLETE_LIMIT]]
+        caching.set_autocomplete(ctype.pk, object_id, term, data)
+
     return HttpResponse(simplejson.dumps(data),
                                     mimetype='application/json')
     
  
+def serialize_object(obj):
+    """
+    The default serializer of the content JSON view.
+    """
+    data = {"id": obj.pk, "name": force_unicode(obj)}
+    if hasattr(obj, "get_absolute_url"):
+        data["url"] = obj.get_absolute_url()
+    return data
+
+
+def get_serializer(ctype):
+    """
+    Returns the serializer for the supplied content type from the
+    POSITION_SERIALIZERS setting.
+    """
+    func = position_settings.SERIALIZERS.get(
+        "%s.%s" % (ctype.app_label, ctype.model), serialize_object)
+    if isinstance(func, basestring):
+        module, attr = func.rsplit('.', 1)
+        func = getattr(import_module(module), attr)
+    return func
+
+
+def content_validators(names, limit):
+    """
+    Returns the ETag and the Last-Modified time of the content of the named
+    positions, from the cached versions of the positions, or None for both
+    if the content of a position is not cached.
+    """
+    if not caching.is_enabled():
+        return None, None
+
+    position_ids, unknown = {}, []
+    for name in names:
+        position_id = caching.get_position_id(name)
+        if position_id is None:
+            unknown.append(name)
+        else:
+            position_ids[name] = position_id
+    if unknown:
+        position_ids.update(Position.objects._resolve_positions(unknown))
+
+    bits, stamps = [str(limit)], []
+    for name in names:
+        position_id, version, stamp = position_ids[name], None, None
+        if position_id:
+            version = caching.get_version(position_id)
+            stamp = caching.get_stamp(position_id, version)
+            if stamp is None:
+                return None, None
+            stamps.append(stamp)
+        bits.append(u'%s:%s:%s:%s' % (name, position_id, version, stamp))
+    return (md5(smart_str(u'|'.join(bits))).hexdigest(),
+        stamps and max(stamps) or None)
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Whether the client has the current content, according to the
+    If-None-Match or else the If-Modified-Since header of the request.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag is not None and (etag in etags or '*' in etags)
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return bool(if_modified_since and last_modified and
+        last_modified <= if_modified_since)
+
+
+def content_json(request, position_names):
+    """
+    Returns the ordered content of one or more positions, separated by
+    commas, as JSON. Repeated requests are answered with a 304 from the
+    cached position versions, without touching the database.
+    """
+    if not simplejson:
+        raise Http404
+
+    names = [name for name in position_names.split(',') if name]
+    try:
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        limit = None
+
+    etag, last_modified = content_validators(names, limit)
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        contents = Position.objects.get_content_many(names, count=limit,
+            as_contenttype=False)
+        data = {}
+        for name in names:
+            data[name] = [{
+                "content_type": "%s.%s" % (item.content_type.app_label,
+                    item.content_type.model),
+                "object_id": item.object_id,
+                "order": item.order,
+                "object": get_serializer(item.content_type)(
+                    item.content_object),
+            } for item in contents[name]]
+        response = HttpResponse(simplejson.dumps(data),
+            mimetype='application/json')
+        if etag is None:
+            # The content is cached now.
+            etag, last_modified = content_validators(names, limit)
+
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
 def add(request, position_name, type, id):
     
-    position = get_object_or_404(Position, name__iexact=position_name)
+    position = Position.objects.get_by_name(position_name)
+    if position is None:
+        raise Http404
     ctype = get_object_or_404(ContentType, pk=type)
     
     obj = ctype.get_object_for_this_type(id=id)
@@ -80,7 +220,9 @@ def remove(request, position_name, type, id):
     from the specified Position if it has already been added.
     """
     next = request.GET.get('next', '')
-    position = get_object_or_404(Position, name__iexact=position_name)
+    position = Position.objects.get_by_name(position_name)
+    if position is None:
+        raise Http404
         
     ctype = get_object_or_404(ContentType, pk=type)
     obj = ctype.get_object_for_this_type(id=id)
@@ -95,49 +237,129 @@ def remove(request, position_name, type, id):
     return HttpResponseRedirect(next)
 remove = staff_member_required(remove)
 
+def get_change_url(obj):
+    """
+    Returns the admin change url of a content object, or "".
+    """
+    if obj is None or not hasattr(obj, "_meta"):
+        return ""
+    try:
+        return reverse("admin:%s_%s_change" % (obj._meta.app_label,
+            obj._meta.module_name), args=(obj.pk,))
+    except NoReverseMatch:
+        return ""
+
+def order_message(orders, removed):
+    message = []
+    if orders:
+        message.append("Position content was re-ordered.")
+    if removed:
+        message.append("%s position content was removed." % len(removed))
+    return " ".join(message)
+
 def order_content(request, position_id, template_name='admin/positions/order.html'):
     
     position = get_object_or_404(Position, pk=position_id)
+    paginator = Paginator(position.positioncontent_set.select_related(
+        'content_type').order_by('order'),
+        position_settings.ORDER_PAGE_SIZE)
+    try:
+        page = paginator.page(request.REQUEST.get('page', 1))
+    except (PageNotAnInteger, EmptyPage):
+        page = paginator.page(1)
+    contents = list(page.object_list)
+    for content in contents:
+        content.position = position
         
     forms = []
     if request.method == 'POST':
         if 'cancel' in request.POST:
             return HttpResponseRedirect('/%s/positions/position/' % reverse("admin:index"))
         
-        re_order = False
-        for content in position.positioncontent_set.all():
+        # Only the content of the page is submitted
+        orders, removed = {}, []
+        for content in contents:
             original_order = content.order
             form = PositionContentOrderForm(request.POST, instance=content, prefix=str(content.pk))
             forms.append(form)
             if form.is_valid():
                 if form.cleaned_data['order'] >= 0:
                     if form.cleaned_data['order'] != original_order:
-                        re_order = True
-                    form.save()
+                        orders[content.pk] = form.cleaned_data['order']
                 else:
-                    obj = form.instance
-                    update_histories(request, obj.content_object, position, DELETION)
-                    form.instance.delete()
-        if re_order:
-            update_position_history(request, None, position, CHANGE, "Position content was re-ordered.")
-        return HttpResponseRedirect('.')       
+                    removed.append(content.pk)
+        if orders or removed:
+            PositionContent.objects.set_order(position, orders, removed)
+            update_position_history(request, None, position, CHANGE,
+                order_message(orders, removed))
+        return HttpResponseRedirect('?page=%s' % page.number)
     else:
-        for content in position.positioncontent_set.all():
+        content_objects = Position.objects._get_content_objects(contents)
+        for content in contents:
+            obj = content_objects.get((content.content_type_id, unicode(content.object_id)))
+            setattr(content, PositionContent.content_object.cache_attr, obj)
             form = PositionContentOrderForm(instance=content, prefix=str(content.pk))
             form.fields['order'].label = mark_safe('<span class="position_order">%s</span> %s ' % (content.order+1, content))
             form.fields['order'].content = content
-            form.fields['order'].content_edit = ""
-            if content.content_object and hasattr(content.content_object, "_meta"):
-                admin_url_name = "admin:%s_%s_change" % (content.content_object._meta.app_label, content.content_object._meta.module_name)
-                form.fields['order'].content_edit = reverse(admin_url_name, args=(content.content_object.pk,))
+            form.fields['order'].content_edit = get_change_url(obj)
             forms.append(form)
     
     return render_to_response(template_name, 
                                 {'position': position,
-                                 'forms': forms,}, 
+                                 'forms': forms,
+                                 'page': page,
+                                 'paginator': paginator,}, 
                                  context_instance=RequestContext(request))      
 order_content = staff_member_required(order_content)
 order_content = never_cache(order_content)
+
+def order_content_bulk(request, position_id):
+    """
+    Applies a new order to the content of a position in one transaction.
+
+    [order] is the comma separated ids of the position content in their new
+    order, [remove] the ids of the position content to remove. Content left
+    out of [order] follows the content listed, in its current order.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not simplejson:
+        raise Http404
+    position = get_object_or_404(Position, pk=position_id)
+
+    def ids(key):
+        try:
+            return [int(pk) for pk in request.POST.get(key, '').split(',') if pk]
+        except ValueError:
+            return None
+    order, remove = ids('order'), ids('remove')
+    if order is None or remove is None:
+        return HttpResponseBadRequest("The ids must be integers.")
+
+    items = list(position.positioncontent_set.order_by('order',
+        '-add_date').values_list('pk', 'order'))
+    current = dict(items)
+    removed = [pk for pk in remove if pk in current]
+    listed = []
+    for pk in order:
+        if pk in current and pk not in removed and pk not in listed:
+            listed.append(pk)
+    listed.extend([pk for pk, o in items
+        if pk not in listed and pk not in removed])
+    orders = {}
+    for i, pk in enumerate(listed):
+        if current[pk] != i + 1:
+            orders[pk] = i + 1
+
+    if orders or removed:
+        PositionContent.objects.set_order(position, orders, removed)
+        update_position_history(request, None, position, CHANGE,
+            order_message(orders, removed))
+
+    return HttpResponse(simplejson.dumps({"ordered": len(orders),
+        "removed": len(removed)}), mimetype='application/json')
+order_content_bulk = staff_member_required(order_content_bulk)
+order_content_bulk = never_cache(order_content_bulk)
     
 def update_histories(request, obj, position, action):
     """ Update both object history and posistion history """
@@ -158,7 +380,7 @@ def update_object_history(request, obj, position, action, message=None):
             action_message = 'changed'
         message = 'Position %s was %s. ' %(position, action_message)
         
-    LogEntry.objects.log_action(
+    history.log(
         user_id         = request.user.pk, 
         content_type_id = ContentType.objects.get_for_model(obj).pk,
         object_id       = obj.pk,
@@ -184,7 +406,7 @@ def update_position_history(request, obj, position, action, message=None):
     if not message:
         "Empty message."
         
-    LogEntry.objects.log_action(
+    history.log(
         user_id         = request.user.pk, 
         content_type_id = ContentType.objects.get_for_model(position).pk,
         object_id       = position.pk,